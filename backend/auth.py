@@ -0,0 +1,18 @@
+from django.contrib.auth.backends import ModelBackend
+
+from backend.models import Profile
+
+
+class ProfileBackend(ModelBackend):
+    """
+    Loads the user of every request together with their current contest participation and its contest, which
+    ContestMiddleware needs on every request.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = Profile._default_manager.select_related('current_contest__contest') \
+                          .defer('current_contest__contest__description').get(pk=user_id)
+        except Profile.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -1,9 +1,13 @@
+import time
+
 import pytz
 from django.conf import settings
 from django.db import connection
 from django.utils import timezone
 from django.utils.timezone import make_aware
 
+from education.access import get_access_version
+
 class EmathLoginMiddleware(object):
     def __init__(self, get_respone):
         self.get_response = get_respone
@@ -16,13 +20,32 @@ class EmathLoginMiddleware(object):
 
 
 class ContestMiddleware(object):
+    # (participation id, contest id, end timestamp, access version) of the current contest, as last validated.
+    SESSION_KEY = '_current_contest'
+
     def __init__(self, get_response):
         self.get_response = get_response
 
+    def update_contest(self, request, profile):
+        participation_id = profile.current_contest_id
+        if participation_id is None:
+            return
+        state = request.session.get(self.SESSION_KEY)
+        if state is not None and state[0] == participation_id and time.time() < state[2] and \
+                state[3] == get_access_version(state[1], profile.id):
+            return
+
+        profile.update_contest()
+        participation = profile.current_contest
+        if participation is not None:
+            request.session[self.SESSION_KEY] = (participation.id, participation.contest_id,
+                                                 participation.end_time.timestamp(),
+                                                 get_access_version(participation.contest_id, profile.id))
+
     def __call__(self, request):
         profile = request.user
         if request.user.is_authenticated:
-            profile.update_contest()
+            self.update_contest(request, profile)
             request.participation = profile.current_contest
             request.in_contest = request.participation is not None
         else:
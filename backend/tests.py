@@ -1,3 +1,78 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import auth
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from backend.auth import ProfileBackend
+from backend.middleware import ContestMiddleware
+from backend.models import Profile
+from education.models import Contest, ContestParticipation
+
+
+class ContestStateTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.contest = Contest.objects.create(key='c', name='C', is_visible=True, start_time=now - timedelta(hours=1),
+                                              end_time=now + timedelta(hours=1))
+        self.user = Profile.objects.create_user('user', 'user', 'x')
+        self.user.current_contest = ContestParticipation.objects.create(contest=self.contest, user=self.user)
+        self.user.save()
+
+
+class ProfileBackendTestCase(ContestStateTestCase):
+    def test_loads_current_contest(self):
+        with self.assertNumQueries(1):
+            user = ProfileBackend().get_user(self.user.id)
+            self.assertEqual(user.current_contest.contest.key, 'c')
+
+    def test_inactive_user(self):
+        Profile.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertIsNone(ProfileBackend().get_user(self.user.id))
+
+    def test_sessions_of_the_model_backend(self):
+        # Sessions logged in before ProfileBackend was added name the default backend.
+        self.assertIn('django.contrib.auth.backends.ModelBackend', settings.AUTHENTICATION_BACKENDS)
+        request = RequestFactory().get('/')
+        request.session = {auth.SESSION_KEY: str(self.user.id),
+                           auth.BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+                           auth.HASH_SESSION_KEY: self.user.get_session_auth_hash()}
+        self.assertEqual(auth.get_user(request), self.user)
+
+
+class ContestMiddlewareTestCase(ContestStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = {}
+        self.middleware = ContestMiddleware(lambda request: request)
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.session = self.session
+        request.user = ProfileBackend().get_user(self.user.id)
+        with mock.patch.object(Profile, 'update_contest', autospec=True,
+                               side_effect=Profile.update_contest) as update_contest:
+            request = self.middleware(request)
+        return request.participation, update_contest.call_count
+
+    def test_validated_once(self):
+        participation = self.user.current_contest
+        self.assertEqual(self.request(), (participation, 1))
+        self.assertEqual(self.request(), (participation, 0))
+
+    def test_contest_changes(self):
+        self.request()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contest.save()
+        self.assertEqual(self.request(), (self.user.current_contest, 1))
+
+    def test_contest_ended(self):
+        self.request()
+        Contest.objects.filter(id=self.contest.id).update(end_time=timezone.now() - timedelta(minutes=1))
+        with mock.patch('backend.middleware.time.time', return_value=self.contest.end_time.timestamp() + 1):
+            self.assertEqual(self.request(), (None, 1))
+        self.assertIsNone(Profile.objects.get(id=self.user.id).current_contest)
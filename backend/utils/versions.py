@@ -0,0 +1,37 @@
+import time
+
+from django.core.cache import cache
+
+__all__ = ['get_version', 'get_versions', 'bump_versions']
+
+
+def _new_stamp():
+    # Stamps are never reused, so a version key that gets evicted from the cache and recreated can not
+    # accidentally match a stamp some process has still remembered.
+    return time.time_ns()
+
+
+def get_versions(keys):
+    """
+    Returns a dictionary of the current version stamp of every key, creating stamps for keys without one.
+    """
+    keys = list(keys)
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        stamp = _new_stamp()
+        for key in missing:
+            cache.add(key, stamp, None)
+        fresh = cache.get_many(missing)
+        for key in missing:
+            versions[key] = fresh.get(key, stamp)
+    return versions
+
+
+def get_version(key):
+    return get_versions([key])[key]
+
+
+def bump_versions(keys):
+    stamp = _new_stamp()
+    cache.set_many({key: stamp for key in keys}, None)
@@ -1,4 +1,4 @@
-from django.db.models import Q, F
+from django.db.models import F
 from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
@@ -8,6 +8,8 @@ from django.views.generic.list import BaseListView
 from backend.templatetags.gravatar import gravatar
 from backend.models import Profile, Organization
 from education.models import Problem, Contest
+from education.search import search_problems
+from education.visibility import listed_problems_q
 
 def _get_user_queryset(term):
   queryset = Profile.objects
@@ -83,34 +85,32 @@ class ProblemSearchSelectView(BaseListView):
   paginate_by = 20
   
   def get_queryset(self):
-    return Problem.objects.filter(
-      Q(code__icontains=self.term) or Q(name__icontains=self.term)
-    )
+    queryset = Problem.objects.filter(listed_problems_q(self.request.user)).select_related('level') \
+                              .only('code', 'name', 'level__name')
+    if self.level is not None:
+      queryset = queryset.filter(level__code=self.level)
+    return search_problems(queryset, self.term)
   
   def get(self, request, *args, **kwargs):
     self.request = request
     self.kwargs = kwargs
     self.term = kwargs.get('term', request.GET.get('term', ''))
     self.level = request.GET.get('level', None)
-    queryset = self.get_queryset()
-
-    if self.level is not None:
-      queryset = queryset.filter(level__code=self.level)
 
-    self.object_list = self.get_queryset().values_list('code', 'name', 'level__name')
-    # print(self.object_list)
+    self.object_list = self.get_queryset()
 
     context = self.get_context_data()
 
     return JsonResponse({
       'results': [
         {
-          'code': code,
-          'name': name,
-          'level': level,
-          'url': reverse('education:problem_detail', kwargs={'problem': code})
-        } for code, name, level in context['object_list']
-      ]
+          'code': problem.code,
+          'name': problem.name,
+          'level': problem.level and problem.level.name,
+          'url': reverse('education:problem_detail', kwargs={'problem': problem.code})
+        } for problem in context['object_list']
+      ],
+      'more': context['page_obj'].has_next(),
     })
 
   def get_name(self, obj):
@@ -0,0 +1,118 @@
+"""
+The facts about a user that the access checks of a contest need from the database, cached across requests.
+
+The facts of a (user, contest) pair are stored under the version stamps of the contest and of the user. The
+contest's stamp is bumped when the contest or one of its access relations changes; the user's stamp is bumped
+when the user, their organizations or their permissions change, and when they join a contest live or leave it.
+
+The ids of the authors and editors of contests and problems are cached as frozensets as well, under a version
+stamp of their contest or problem that is bumped when its authors or curators change.
+"""
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from backend.utils.versions import bump_versions, get_version, get_versions
+
+__all__ = ['ContestAccess', 'get_contest_access', 'get_access_version', 'has_live_participation',
+           'invalidate_contest_access', 'invalidate_user_access', 'user_access_version_key', 'get_id_set',
+           'invalidate_id_sets']
+
+ACCESS_CACHE_TIMEOUT = 86400
+
+# can_see_private: the user may see every private contest.
+# is_editor: the user is an author or a curator of the contest.
+# is_scoreboard_viewer: the user was allowed to view the scoreboard of the contest.
+# in_organization, is_private_contestant: the user may join the contest as a member of one of its
+# organizations or as one of its private contestants. Only known if the contest is restricted that way.
+ContestAccess = namedtuple('ContestAccess', 'can_see_private is_editor is_scoreboard_viewer in_organization '
+                                            'is_private_contestant')
+
+
+def _contest_version_key(contest_id):
+    return 'contest_access_version:%d' % contest_id
+
+
+def user_access_version_key(user_id):
+    return 'contest_user_access_version:%d' % user_id
+
+
+def _load_contest_access(contest, user):
+    return ContestAccess(
+        can_see_private=user.has_perm('education.see_private_contest') or
+                        user.has_perm('education.edit_all_contest'),
+        is_editor=user.id in contest.editor_ids,
+        is_scoreboard_viewer=contest.view_contest_scoreboard.filter(id=user.id).exists(),
+        in_organization=contest.is_organization_private and
+                        contest.organizations.filter(id__in=user.organizations.all()).exists(),
+        is_private_contestant=contest.is_private and contest.private_contestants.filter(id=user.id).exists(),
+    )
+
+
+def get_contest_access(contest, user):
+    """
+    Returns the ContestAccess of an authenticated user to a contest.
+    """
+    remembered = contest.__dict__.setdefault('_access', {})
+    if user.id in remembered:
+        return remembered[user.id]
+
+    contest_key, user_key = _contest_version_key(contest.id), user_access_version_key(user.id)
+    versions = get_versions([contest_key, user_key])
+    key = 'contest_access:%d:%d:%s:%s' % (contest.id, user.id, versions[contest_key], versions[user_key])
+    access = cache.get(key)
+    if access is None:
+        access = _load_contest_access(contest, user)
+        cache.set(key, access, ACCESS_CACHE_TIMEOUT)
+    remembered[user.id] = access
+    return access
+
+
+def get_access_version(contest_id, user_id):
+    """
+    Returns a stamp that changes whenever the access of a user to a contest may have changed.
+    """
+    contest_key, user_key = _contest_version_key(contest_id), user_access_version_key(user_id)
+    versions = get_versions([contest_key, user_key])
+    return '%s:%s' % (versions[contest_key], versions[user_key])
+
+
+def has_live_participation(contest, user):
+    """
+    Returns whether an authenticated user took part in a contest live.
+    """
+    key = 'contest_participated:%d:%d:%s' % (contest.id, user.id, get_access_version(contest.id, user.id))
+    participated = cache.get(key)
+    if participated is None:
+        participated = contest.users.filter(virtual=0, user=user).exists()
+        cache.set(key, participated, ACCESS_CACHE_TIMEOUT)
+    return participated
+
+
+def invalidate_contest_access(contest_ids):
+    bump_versions([_contest_version_key(contest_id) for contest_id in contest_ids])
+
+
+def invalidate_user_access(user_ids):
+    bump_versions([user_access_version_key(user_id) for user_id in user_ids])
+
+
+def _id_set_version_key(kind, object_id):
+    return '%s_id_sets_version:%d' % (kind, object_id)
+
+
+def get_id_set(kind, object_id, name, load):
+    """
+    Returns the frozenset of ids called name of the object of a kind, calling load to fetch them if they are
+    not cached.
+    """
+    key = '%s_%s:%d:%s' % (kind, name, object_id, get_version(_id_set_version_key(kind, object_id)))
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(load())
+        cache.set(key, ids, ACCESS_CACHE_TIMEOUT)
+    return ids
+
+
+def invalidate_id_sets(kind, object_ids):
+    bump_versions([_id_set_version_key(kind, object_id) for object_id in object_ids])
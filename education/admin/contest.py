@@ -10,6 +10,7 @@ from django.shortcuts import get_object_or_404
 from django.contrib import admin
 from django.conf import settings
 from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import gettext, gettext_lazy as _, ngettext
 from django.utils.html import format_html
 
@@ -19,6 +20,7 @@ from backend.models.profile import Profile
 
 from backend.widgets.martor import AdminMartorWidget, MartorWidget
 
+from education import scoreboard
 from education.models import ContestProblem
 from education.models.contest import Contest, ContestParticipation, ContestSolution
 
@@ -85,7 +87,7 @@ class ContestAdmin(SemanticModelAdmin):
       }),
       (_('Settings'), {
         "fields": (
-          'is_visible', 'scoreboard_visibility', 'points_precision'
+          'is_visible', 'scoreboard_visibility', 'frozen_last_minutes', 'points_precision'
         ),
       }),
       (_('Details'), {'fields': ('description', 'og_image', 'logo_override_image', 'summary')}),
@@ -96,6 +98,7 @@ class ContestAdmin(SemanticModelAdmin):
   ordering = ('key',)
   search_fields = ('key', 'name',)
   date_hierarchy = 'start_time'
+  actions = ['finalize_results']
   actions_on_top = True
   actions_on_bottom = True
 
@@ -125,6 +128,16 @@ class ContestAdmin(SemanticModelAdmin):
                                         count) % count)
   make_hidden.short_description = _('Mark contests as hidden')
 
+  def finalize_results(self, request, queryset):
+    count = 0
+    for contest in queryset.filter(end_time__lte=timezone.now()):
+      scoreboard.finalize_ranks(contest)
+      count += 1
+    self.message_user(request, ngettext('%d contest finalized.',
+                                        '%d contests finalized.',
+                                        count) % count)
+  finalize_results.short_description = _('Finalize rankings of ended contests')
+
   def get_form(self, request, obj=None, **kwargs):
     form = super().get_form(request, obj, **kwargs)
 
@@ -220,9 +233,10 @@ class ContestParticipationAdmin(SemanticModelAdmin):
 
     def recalculate_results(self, request, queryset):
         count = 0
-        for participation in queryset:
-            participation.recompute_results()
-            count += 1
+        for contest in Contest.objects.filter(id__in=queryset.values('contest_id')):
+            participations = ContestParticipation.objects.filter(id__in=queryset.values('id'), contest=contest)
+            contest.recompute_results(participations)
+            count += participations.count()
         self.message_user(request, ngettext('%d participation recalculated.',
                                              '%d participations recalculated.',
                                              count) % count)
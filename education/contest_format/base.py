@@ -25,6 +25,40 @@ class BaseContestFormat(six.with_metaclass(ABCMeta)):
         """
         raise NotImplementedError()
     
+    def update_participations(self, participations):
+        """
+        Recomputes the results of many ContestParticipation objects of this contest at once. Implementations
+        should fetch the data they need in a few grouped queries and write the rows back with bulk_update.
+        The default implementation calls update_participation for every participation.
+        :param participations: A queryset of ContestParticipation objects of this format's contest.
+        :return: None
+        """
+        for participation in participations:
+            self.update_participation(participation)
+
+    def handle_submission(self, participation, submission):
+        """
+        Folds a newly judged submission into a ContestParticipation object's score, cumtime, and format_data
+        fields without recomputing them from every submission. update_participation remains the full
+        recompute used to repair results. Formats that can not update incrementally may rely on this default.
+        Implementations should call ContestParticipation.save() if the results changed.
+        :param participation: A ContestParticipation object.
+        :param submission: The judged Submission object.
+        :return: None
+        """
+        self.update_participation(participation)
+
+    def get_results_timeline(self, participations):
+        """
+        Returns how the results of ContestParticipation objects evolved during the contest, so that a virtual
+        participation can be ranked against them at the same elapsed time. Formats that can not replay their
+        results may keep this default, which raises NotImplementedError.
+        :param participations: A queryset of live ContestParticipation objects of this format's contest.
+        :return: A dictionary mapping every participation id to a list of (elapsed seconds, score, cumtime)
+                 tuples, one for every change of its results, in increasing elapsed time.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def display_user_problem(self, participation, contest_problem):
         """
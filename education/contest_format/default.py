@@ -1,6 +1,7 @@
 from datetime import timedelta
 from django.utils.translation import gettext_lazy
 from django.db.models import Max
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.template.defaultfilters import floatformat
@@ -26,23 +27,33 @@ class DefaultContestFormat(BaseContestFormat):
         for problem in problems:
             max_points += problem.points
         
-        for submission in participation.submissions.all():
+        # Skip attempts that were opened but never submitted.
+        submissions = participation.submissions.exclude(result='PE', time__isnull=True)
+        for submission in submissions:
             if submission.max_points != max_points:
                 submission.judge()
 
-        sub = participation.submissions.aggregate(point=Max('points'))
+        sub = submissions.aggregate(point=Max('points'))
 
-        submission = participation.submissions.filter(points=sub['point']).order_by('date').first()
+        submission = submissions.filter(points=sub['point']).order_by('date').first()
 
         # print(sub)
 
+        # No format data means no best submission, so that handle_submission takes the next one.
+        if submission is None:
+            participation.cumtime = 0
+            participation.score = 0
+            participation.tiebreaker = 0
+            participation.format_data = None
+            participation.save()
+            return
 
         dt = (submission.date - participation.start).total_seconds()
         cumtime += dt
         
         for sub_problem in submission.problems.all():
             # print(sub_problem.problem.id)
-            format_data[str(sub_problem.problem.id)] = {'status': sub_problem.result}
+            format_data[str(sub_problem.problem_id)] = {'status': sub_problem.result}
         
         participation.cumtime = max(cumtime, 0)
         participation.score = round(submission.points * 100 / max_points, self.contest.points_precision)
@@ -52,7 +63,104 @@ class DefaultContestFormat(BaseContestFormat):
         # print(format_data)
         
         participation.save()
+
+    def update_participations(self, participations):
+        from education.grading import AnswerKey, grade_problems, contest_problem_id, contest_problem_points
+        from education.models import ContestParticipation, Submission, SubmissionProblem
+
+        participations = list(participations)
+        if not participations:
+            return
+
+        max_points = 0
+        for problem in self.contest.contest_problems.all():
+            max_points += problem.points
+
+        # Skip attempts that were opened but never submitted.
+        submissions = list(Submission.objects.filter(user__in=participations)
+                                             .exclude(result='PE', time__isnull=True)
+                                             .only('id', 'user_id', 'date', 'points', 'max_points', 'result'))
+
+        stale = {submission.id: submission for submission in submissions if submission.max_points != max_points}
+        if stale:
+            rows = list(SubmissionProblem.objects.filter(submission_id__in=stale).select_related('problem'))
+            answers = AnswerKey.for_problems({contest_problem_id(row) for row in rows})
+            for submission in stale.values():
+                submission.points = 0.0
+                submission.max_points = float(max_points)
+            grade_problems(rows, contest_problem_id, contest_problem_points, answers)
+            for row in rows:
+                stale[row.submission_id].points += row.points
+            for submission in stale.values():
+                submission.result = 'AC' if submission.points == submission.max_points else 'WA'
+            SubmissionProblem.objects.bulk_update(rows, ['result', 'points'])
+            Submission.objects.bulk_update(stale.values(), ['points', 'max_points', 'result'])
+
+        best = {}
+        for submission in submissions:
+            current = best.get(submission.user_id)
+            if current is None or (submission.points, current.date) > (current.points, submission.date):
+                best[submission.user_id] = submission
+
+        format_data = {submission.id: {} for submission in best.values()}
+        for submission_id, problem_id, result in SubmissionProblem.objects.filter(submission_id__in=format_data) \
+                                                                         .values_list('submission_id', 'problem_id',
+                                                                                      'result'):
+            format_data[submission_id][str(problem_id)] = {'status': result}
+
+        for participation in participations:
+            participation.contest = self.contest
+            submission = best.get(participation.id)
+            if submission is None:
+                participation.cumtime = 0
+                participation.score = 0
+                participation.format_data = None
+            else:
+                participation.cumtime = max((submission.date - participation.start).total_seconds(), 0)
+                participation.score = round(submission.points * 100 / max_points, self.contest.points_precision)
+                participation.format_data = format_data[submission.id]
+            participation.tiebreaker = 0
+
+        ContestParticipation.objects.bulk_update(participations, ['cumtime', 'score', 'tiebreaker', 'format_data'])
+
+    def handle_submission(self, participation, submission):
+        if not submission.max_points:
+            return
+
+        score = round(submission.points * 100 / submission.max_points, self.contest.points_precision)
+        # Submissions arrive in order, so an earlier submission with the same score keeps its place. The format
+        # data of a participation is None until it has a best submission, and may be empty after that.
+        if participation.format_data is not None and score <= participation.score:
+            return
+
+        participation.cumtime = max((submission.date - participation.start).total_seconds(), 0)
+        participation.score = score
+        participation.tiebreaker = 0
+        participation.format_data = {str(problem_id): {'status': result} for problem_id, result in
+                                     submission.problems.values_list('problem_id', 'result')}
+        participation.save(update_fields=['cumtime', 'score', 'tiebreaker', 'format_data'])
     
+    def get_results_timeline(self, participations):
+        from education.models import Submission
+
+        timeline = {participation_id: [] for participation_id in participations.values_list('id', flat=True)}
+        start = self.contest.start_time
+        # Results change when the answers are submitted, but their cumtime counts up to when the attempt was
+        # opened, as in update_participation.
+        submissions = Submission.objects.filter(user_id__in=timeline).exclude(result='PE', time__isnull=True) \
+                                        .annotate(submitted=Coalesce('time', 'date')).order_by('submitted', 'id') \
+                                        .values_list('user_id', 'date', 'submitted', 'points', 'max_points')
+        for participation_id, date, submitted, points, max_points in submissions.iterator():
+            if not max_points:
+                continue
+            score = round(points * 100 / max_points, self.contest.points_precision)
+            steps = timeline[participation_id]
+            # Only a strictly better submission replaces the best one, as in handle_submission.
+            if not steps or score > steps[-1][1]:
+                steps.append((max((submitted - start).total_seconds(), 0), score,
+                              max((date - start).total_seconds(), 0)))
+        return timeline
+
     def display_user_problem(self, participation, contest_problem):
         # print('display_user_problem')
         format_data = (participation.format_data or {}).get(str(contest_problem.id))
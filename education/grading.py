@@ -0,0 +1,166 @@
+from collections import namedtuple
+from operator import attrgetter
+
+from django.core.cache import cache
+from django.db import transaction
+
+from backend.utils.versions import bump_versions, get_versions
+from education.models.problem import Answer
+
+__all__ = ['AnswerEntry', 'AnswerKey', 'get_answer_entries', 'invalidate_answer_entries', 'normalize_answer',
+           'grade_problems', 'contest_problem_id', 'contest_problem_points', 'ingest_answers']
+
+contest_problem_id = attrgetter('problem.problem_id')
+contest_problem_points = attrgetter('problem.points')
+
+ANSWER_ENTRY_CACHE_TIMEOUT = 86400
+ANSWER_ENTRY_LOCAL_LIMIT = 10000
+
+# correct: the description of the correct option of a multiple-choice problem.
+# fill: the normalized answer of a fill-in problem.
+# options: the descriptions of every answer of the problem, in creation order.
+AnswerEntry = namedtuple('AnswerEntry', 'correct fill options')
+
+# problem id -> (version stamp, AnswerEntry), shared by every request served by this process.
+_local_entries = {}
+
+
+def normalize_answer(text):
+    return ' '.join((text or '').split())
+
+
+def _version_key(problem_id):
+    return 'answer_key_version:%d' % problem_id
+
+
+def _entry_key(problem_id, version):
+    return 'answer_key:%d:%s' % (problem_id, version)
+
+
+def _load_answer_entries(problem_ids):
+    rows = {problem_id: ([], None) for problem_id in problem_ids}
+    answers = Answer.objects.filter(problem_id__in=problem_ids).order_by('id') \
+                    .values_list('problem_id', 'problem__answer_type', 'description', 'is_correct')
+    for problem_id, answer_type, description, is_correct in answers:
+        options, correct = rows[problem_id]
+        options.append(description)
+        if correct is None and (is_correct or answer_type == 'fill'):
+            correct = (answer_type, description)
+        rows[problem_id] = options, correct
+
+    entries = {}
+    for problem_id, (options, correct) in rows.items():
+        answer_type, description = correct or (None, None)
+        entries[problem_id] = AnswerEntry(
+            correct=description if answer_type == 'mc' else None,
+            fill=normalize_answer(description) if answer_type == 'fill' else None,
+            options=tuple(options),
+        )
+    return entries
+
+
+def get_answer_entries(problem_ids):
+    """
+    Returns a dictionary mapping every problem id to its AnswerEntry. Entries are served from this process'
+    memory while their version stamp is current, then from the shared cache, and only then from the database.
+    """
+    problem_ids = set(problem_ids)
+    if not problem_ids:
+        return {}
+
+    versions = get_versions(_version_key(problem_id) for problem_id in problem_ids)
+    versions = {problem_id: versions[_version_key(problem_id)] for problem_id in problem_ids}
+
+    entries = {}
+    for problem_id, version in versions.items():
+        local = _local_entries.get(problem_id)
+        if local is not None and local[0] == version:
+            entries[problem_id] = local[1]
+
+    stale = [problem_id for problem_id in problem_ids if problem_id not in entries]
+    if stale:
+        keys = {_entry_key(problem_id, versions[problem_id]): problem_id for problem_id in stale}
+        for key, entry in cache.get_many(keys).items():
+            entries[keys[key]] = AnswerEntry(*entry)
+
+        missing = [problem_id for problem_id in stale if problem_id not in entries]
+        if missing:
+            loaded = _load_answer_entries(missing)
+            cache.set_many({_entry_key(problem_id, versions[problem_id]): tuple(entry)
+                            for problem_id, entry in loaded.items()}, ANSWER_ENTRY_CACHE_TIMEOUT)
+            entries.update(loaded)
+
+        if len(_local_entries) + len(stale) > ANSWER_ENTRY_LOCAL_LIMIT:
+            _local_entries.clear()
+        for problem_id in stale:
+            _local_entries[problem_id] = (versions[problem_id], entries[problem_id])
+
+    return entries
+
+
+def invalidate_answer_entries(problem_ids):
+    bump_versions([_version_key(problem_id) for problem_id in problem_ids])
+
+
+class AnswerKey(dict):
+    """
+    Maps a problem id to the AnswerEntry a student's answer is graded against.
+    """
+
+    @classmethod
+    def for_problems(cls, problem_ids):
+        return cls(get_answer_entries(problem_ids))
+
+    def is_correct(self, problem_id, output):
+        entry = self.get(problem_id)
+        if entry is None:
+            return False
+        if entry.fill is not None:
+            return normalize_answer(output) == entry.fill
+        return entry.correct is not None and entry.correct == output
+
+
+def grade_problems(rows, problem_id, points, answers=None):
+    """
+    Grades submission problem rows in memory. The rows' result and points fields are updated but not
+    saved, so callers can write all of them back with a single bulk_update.
+    :param rows: A list of SubmissionProblem objects.
+    :param problem_id: A callable returning the id of the Problem a row answers.
+    :param points: A callable returning the points granted to a correct row.
+    :param answers: An AnswerKey covering the rows' problems. Loaded from the answer index if not given.
+    :return: The total points granted.
+    """
+    if answers is None:
+        answers = AnswerKey.for_problems({problem_id(row) for row in rows})
+
+    total = 0.0
+    for row in rows:
+        row.result = answers.is_correct(problem_id(row), row.output)
+        row.points = points(row) if row.result else 0
+        total += row.points
+    return total
+
+
+def ingest_answers(submission, problems, data, field='problem'):
+    """
+    Stores the answers posted for a submission with a single bulk_create. The answer to every problem of the
+    problem set is read from the ``answer_<problem id>`` field of data; fields naming other problems are
+    ignored. The submission row is locked while storing, so a submission can only be answered once.
+    :param submission: A Submission object whose problems relation holds the answers.
+    :param problems: The problem set of the submission, e.g. ContestProblem objects.
+    :param data: The posted form data.
+    :param field: The name of the answer model's foreign key to the problems of the problem set.
+    :return: False if the submission already had answers, True otherwise.
+    """
+    model = submission.problems.model
+    with transaction.atomic():
+        type(submission).objects.select_for_update().values_list('id', flat=True).get(id=submission.id)
+        if submission.problems.exists():
+            return False
+        rows = []
+        for problem in problems:
+            output = data.get('answer_%d' % problem.id)
+            if output is not None:
+                rows.append(model(submission=submission, output=output, **{field: problem}))
+        model.objects.bulk_create(rows)
+    return True
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from education.models import Problem
+from education.search import index_problems
+
+
+class Command(BaseCommand):
+    help = 'rewrite the search documents of every problem'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='problems indexed per transaction')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        ids = list(Problem.objects.values_list('id', flat=True))
+        for index in range(0, len(ids), options['chunk_size']):
+            index_problems(ids[index:index + options['chunk_size']])
+        self.stdout.write('indexed %d problems in %.2fs' % (len(ids), time.perf_counter() - start))
@@ -0,0 +1,112 @@
+import time
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from education.grading import AnswerKey
+from education.models import Contest
+from education.models.submission import Submission, SubmissionProblem
+
+# Set in every pool worker by _init_worker, so the answer key is sent once per process instead of once per chunk.
+_answers = None
+_problems = None
+
+
+def _init_worker(answers, problems):
+    global _answers, _problems
+    _answers = answers
+    _problems = problems
+
+
+def _grade_chunk(rows):
+    graded = []
+    for id, submission_id, contest_problem_id, output in rows:
+        problem_id, points = _problems.get(contest_problem_id, (None, 0))
+        result = _answers.is_correct(problem_id, output)
+        graded.append((id, submission_id, result, points if result else 0))
+    return graded
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'regrade every submission of a contest against its current answer key'
+
+    def add_arguments(self, parser):
+        parser.add_argument('key', help='key of the contest to regrade')
+        parser.add_argument('--processes', type=int, default=cpu_count(), help='number of grading processes')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='submission problems graded per task')
+        parser.add_argument('--dry-run', action='store_true', help='only print the scores that would change')
+
+    def handle(self, *args, **options):
+        try:
+            contest = Contest.objects.get(key=options['key'])
+        except Contest.DoesNotExist:
+            raise CommandError('contest "%s" does not exist' % options['key'])
+
+        problems = {id: (problem_id, points) for id, problem_id, points in
+                    contest.contest_problems.values_list('id', 'problem_id', 'points')}
+        max_points = float(sum(points for problem_id, points in problems.values()))
+        answers = AnswerKey.for_problems({problem_id for problem_id, points in problems.values()})
+
+        submissions = {id: (points, max_points, result) for id, points, max_points, result in
+                       Submission.objects.filter(contest=contest).exclude(result='PE')
+                                 .values_list('id', 'points', 'max_points', 'result')}
+        old = {id: (result, points) for id, result, points in
+               SubmissionProblem.objects.filter(submission_id__in=submissions)
+                                        .values_list('id', 'result', 'points').iterator()}
+        # Read here rather than lazily: the pool consumes its input from a thread of its own, which would read
+        # through a database connection of its own, outside this one's transaction, and never close it.
+        rows = list(SubmissionProblem.objects.filter(submission_id__in=submissions)
+                                             .values_list('id', 'submission_id', 'problem_id', 'output'))
+
+        start = time.perf_counter()
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        totals = defaultdict(float)
+        changed_rows = []
+        with Pool(max(options['processes'], 1), initializer=_init_worker, initargs=(answers, problems)) as pool:
+            for graded in pool.imap_unordered(_grade_chunk, _chunks(rows, options['chunk_size'])):
+                for id, submission_id, result, points in graded:
+                    totals[submission_id] += points
+                    if old[id] != (result, points):
+                        changed_rows.append(SubmissionProblem(id=id, result=result, points=points))
+        elapsed = time.perf_counter() - start
+
+        changed_submissions = []
+        for id, (points, old_max_points, result) in submissions.items():
+            new_result = 'AC' if totals[id] == max_points else 'WA'
+            if (points, old_max_points, result) != (totals[id], max_points, new_result):
+                changed_submissions.append(Submission(id=id, points=totals[id], max_points=max_points,
+                                                      result=new_result))
+                if options['dry_run'] or options['verbosity'] > 1:
+                    self.stdout.write('submission %d: %s/%s %s -> %s/%s %s' % (
+                        id, points, old_max_points, result, totals[id], max_points, new_result))
+
+        self.stdout.write('graded %d answers of %d submissions in %.2fs (%.0f answers/s)' % (
+            len(old), len(submissions), elapsed, len(old) / elapsed if elapsed else 0))
+        self.stdout.write('%d answers and %d submissions changed' % (len(changed_rows), len(changed_submissions)))
+
+        if options['dry_run']:
+            return
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            SubmissionProblem.objects.bulk_update(changed_rows, ['result', 'points'], batch_size=options['chunk_size'])
+            Submission.objects.bulk_update(changed_submissions, ['points', 'max_points', 'result'],
+                                           batch_size=options['chunk_size'])
+            participations = contest.users.filter(id__in=Submission.objects.filter(
+                id__in=[submission.id for submission in changed_submissions]).values('user_id'))
+            contest.recompute_results(participations)
+        self.stdout.write('wrote results and recomputed participations in %.2fs' % (time.perf_counter() - start))
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:36
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0007_alter_problem_difficult_alter_problemtype_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='frozen_last_minutes',
+            field=models.IntegerField(default=0, help_text='If set, the scoreboard shown to contestants stops updating for the last X minutes of the contest.', validators=[django.core.validators.MinValueValidator(0)], verbose_name='frozen last minutes'),
+        ),
+        migrations.CreateModel(
+            name='ContestScoreboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='snapshot time')),
+                ('kind', models.CharField(choices=[('P', 'Periodic'), ('F', 'Freeze')], default='P', max_length=1, verbose_name='snapshot kind')),
+                ('size', models.IntegerField(default=0, verbose_name='participations')),
+                ('data', models.BinaryField(verbose_name='packed scoreboard')),
+                ('contest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scoreboard_snapshots', to='education.contest', verbose_name='contest')),
+            ],
+            options={
+                'verbose_name': 'scoreboard snapshot',
+                'verbose_name_plural': 'scoreboard snapshots',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='contestscoreboardsnapshot',
+            index=models.Index(fields=['contest', 'time'], name='education_c_contest_2af8c6_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0008_contest_scoreboard_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contestparticipation',
+            name='rank',
+            field=models.IntegerField(blank=True, default=None, help_text='The rank of a live participation, stored once its contest ended.', null=True, verbose_name='final rank'),
+        ),
+        migrations.AddIndex(
+            model_name='contestparticipation',
+            index=models.Index(fields=['contest', 'rank'], name='education_c_contest_910be4_idx'),
+        ),
+    ]
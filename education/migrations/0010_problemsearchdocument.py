@@ -0,0 +1,84 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:07
+
+from django.db import OperationalError, migrations, models
+import django.db.models.deletion
+
+FTS_TABLE = 'education_problemsearch_fts'
+DOCUMENT_TABLE = 'education_problemsearchdocument'
+COLUMNS = 'code, name, description, category'
+NEW_COLUMNS = 'new.code, new.name, new.description, new.category'
+OLD_COLUMNS = 'old.code, old.name, old.description, old.category'
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', content_rowid='problem_id', "
+    "tokenize='unicode61 remove_diacritics 2')" % (FTS_TABLE, COLUMNS, DOCUMENT_TABLE),
+    "CREATE TRIGGER %s_insert AFTER INSERT ON %s BEGIN "
+    "INSERT INTO %s(rowid, %s) VALUES (new.problem_id, %s); END" % (FTS_TABLE, DOCUMENT_TABLE, FTS_TABLE, COLUMNS,
+                                                                   NEW_COLUMNS),
+    "CREATE TRIGGER %s_delete AFTER DELETE ON %s BEGIN "
+    "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.problem_id, %s); END" % (
+        FTS_TABLE, DOCUMENT_TABLE, FTS_TABLE, FTS_TABLE, COLUMNS, OLD_COLUMNS),
+    "CREATE TRIGGER %s_update AFTER UPDATE ON %s BEGIN "
+    "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.problem_id, %s); "
+    "INSERT INTO %s(rowid, %s) VALUES (new.problem_id, %s); END" % (
+        FTS_TABLE, DOCUMENT_TABLE, FTS_TABLE, FTS_TABLE, COLUMNS, OLD_COLUMNS, FTS_TABLE, COLUMNS, NEW_COLUMNS),
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        try:
+            for sql in SQLITE_INDEX:
+                schema_editor.execute(sql)
+        except OperationalError:
+            # SQLite was built without FTS5: problems are searched through an in-process index instead.
+            pass
+    elif schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE %s ADD FULLTEXT INDEX education_problemsearch_text (%s)' % (
+            DOCUMENT_TABLE, COLUMNS))
+
+    Problem = apps.get_model('education', 'Problem')
+    ProblemType = apps.get_model('education', 'ProblemType')
+    ProblemSearchDocument = apps.get_model('education', 'ProblemSearchDocument')
+    categories = {}
+    for problem_id, name, short_name in ProblemType.objects.values_list('problem_id', 'group__name',
+                                                                        'group__short_name'):
+        categories.setdefault(problem_id, []).append('%s %s' % (name, short_name))
+    ProblemSearchDocument.objects.bulk_create(
+        ProblemSearchDocument(problem_id=id, code=code, name=name, description=description,
+                              category=' '.join(categories.get(id, ())))
+        for id, code, name, description in Problem.objects.values_list('id', 'code', 'name', 'description')
+        .iterator())
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS %s_%s' % (FTS_TABLE, trigger))
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0009_contestparticipation_rank'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemSearchDocument',
+            fields=[
+                ('problem', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='education.problem', verbose_name='problem')),
+                ('code', models.CharField(max_length=20, verbose_name='problem code')),
+                ('name', models.CharField(max_length=100, verbose_name='problem name')),
+                ('description', models.TextField(blank=True, verbose_name='problem body')),
+                ('category', models.TextField(blank=True, verbose_name='category')),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True, verbose_name='last indexed')),
+            ],
+            options={
+                'verbose_name': 'problem search document',
+                'verbose_name_plural': 'problem search documents',
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('education', '0010_problemsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contestparticipation',
+            index=models.Index(fields=['contest', 'virtual', 'is_disqualified', '-score', 'cumtime', 'tiebreaker'], name='education_c_ranking_idx'),
+        ),
+    ]
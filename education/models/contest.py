@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.db import models, transaction
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
@@ -6,10 +8,16 @@ from django.utils.translation import gettext_lazy as _, gettext
 from django.utils.functional import cached_property
 from django.utils import timezone
 from django.db.models import Q, F
+from django.dispatch import Signal
 
 from backend.models import Profile, Organization
 from .problem import Problem
 from education import contest_format
+from education.access import get_contest_access, get_id_set, has_live_participation
+
+# Sent by Contest.recompute_results once the results of many participations were rewritten in bulk, without
+# saving them one by one. Receivers get the contest as instance and the recomputed participations.
+participations_updated = Signal()
 
 
 class Contest(models.Model):
@@ -73,6 +81,10 @@ class Contest(models.Model):
     points_precision = models.IntegerField(verbose_name=_('precision points'), default=3,
                                            validators=[MinValueValidator(0), MaxValueValidator(10)],
                                            help_text=_('Number of digits to round points to.'))
+    frozen_last_minutes = models.IntegerField(verbose_name=_('frozen last minutes'), default=0,
+                                              validators=[MinValueValidator(0)],
+                                              help_text=_('If set, the scoreboard shown to contestants stops '
+                                                          'updating for the last X minutes of the contest.'))
 
     def __str__(self) -> str:
         return self.name
@@ -116,6 +128,16 @@ class Contest(models.Model):
     def ended(self):
         return self.end_time < self._now
 
+    @cached_property
+    def freeze_time(self):
+        if self.frozen_last_minutes <= 0:
+            return None
+        return self.end_time - timedelta(minutes=self.frozen_last_minutes)
+
+    @cached_property
+    def is_frozen(self):
+        return self.freeze_time is not None and self.freeze_time <= self._now < self.end_time
+
     @cached_property
     def can_join(self):
         return self.start_time <= self._now
@@ -136,17 +158,19 @@ class Contest(models.Model):
 
     @cached_property
     def author_ids(self):
-        return Contest.authors.through.objects.filter(contest=self).values_list('profile_id', flat=True)
+        return get_id_set('contest', self.id, 'authors', lambda: (
+            Contest.authors.through.objects.filter(contest=self).values_list('profile_id', flat=True)
+        ))
     
     @cached_property
     def editor_ids(self):
-        return self.author_ids.union(
+        return get_id_set('contest', self.id, 'editors', lambda: self.author_ids.union(
             Contest.curators.through.objects.filter(contest=self).values_list('profile_id', flat=True)
-        )
+        ))
 
     def update_user_count(self):
         self.user_count = self.users.filter(virtual=0).count()
-        self.save()
+        self.save(update_fields=['user_count'])
 
     update_user_count.alters_data = True
 
@@ -164,10 +188,11 @@ class Contest(models.Model):
                 raise self.PrivateContest()
             return
         
-        if user.has_perm('education.see_private_contest') or user.has_perm('education.edit_all_contest'):
+        access = get_contest_access(self, user)
+        if access.can_see_private:
             return
         
-        if user.id in self.editor_ids:
+        if access.is_editor:
             return
         
         if not self.is_visible:
@@ -176,11 +201,11 @@ class Contest(models.Model):
         if not self.is_private and not self.is_organization_private:
             return
 
-        if self.view_contest_scoreboard.filter(id=user.id).exists():
+        if access.is_scoreboard_viewer:
             return
 
-        in_org = self.organizations.filter(id__in=user.organizations.all()).exists()
-        in_users = self.private_contestants.filter(id=user.id).exists()
+        in_org = access.in_organization
+        in_users = access.is_private_contestant
 
         if self.is_private and not self.is_organization_private:
             if in_users:
@@ -201,11 +226,8 @@ class Contest(models.Model):
             return True
         
     def has_completed_contest(self, user: Profile):
-        if user.is_authenticated:
-            participation = self.users.filter(virtual=ContestParticipation.LIVE, user=user).first()
-            if participation and participation.ended:
-                return True
-        return False
+        # Live participations end with the contest.
+        return user.is_authenticated and self.ended and has_live_participation(self, user)
 
     @cached_property
     def show_scoreboard(self):
@@ -230,16 +252,21 @@ class Contest(models.Model):
             return False
         return True
 
+    def can_see_unfrozen_scoreboard(self, user: Profile):
+        if not self.is_frozen:
+            return True
+        if not user.is_authenticated:
+            return False
+        access = get_contest_access(self, user)
+        return access.can_see_private or access.is_editor
+
     def can_see_full_scoreboard(self, user: Profile):
         if self.show_scoreboard:
             return True
         if not user.is_authenticated:
             return False
-        if user.has_perm('education.see_private_contest') or user.has_perm('education.edit_all_contest'):
-            return True
-        if user.id in self.editor_ids:
-            return True
-        if self.view_contest_scoreboard.filter(id=user.id).exists():
+        access = get_contest_access(self, user)
+        if access.can_see_private or access.is_editor or access.is_scoreboard_viewer:
             return True
         if self.scoreboard_visibility == self.SCOREBOARD_AFTER_PARTICIPATION and self.has_completed_contest(user):
             return True
@@ -252,19 +279,23 @@ class Contest(models.Model):
                 .defer('description').distinct()
         queryset = cls.objects.defer('description')
         if not (user.has_perm('education.see_private_contest') or user.has_perm('education.edit_all_contest')):
-            q = Q(is_visible=True)
-            q &= (
-                Q(view_contest_scoreboard=user) |
-                Q(is_organization_private=False, is_private=False) |
-                Q(is_organization_private=False, is_private=True, private_contestants=user) |
-                Q(is_organization_private=True, is_private=False, organizations__in=user.organizations.all()) |
-                Q(is_organization_private=True, is_private=True, organizations__in=user.organizations.all(),
-                  private_contestants=user)
-            )
-            q |= Q(authors=user)
-            q |= Q(curators=user)
+            from education.visibility import get_contest_grants, public_contests_q
+            q = public_contests_q()
+            grants = get_contest_grants(user)
+            if grants:
+                q |= Q(id__in=grants)
             queryset = queryset.filter(q)
-        return queryset.distinct()
+        return queryset
+
+    def recompute_results(self, participations=None):
+        if participations is None:
+            participations = self.users.all()
+        with transaction.atomic():
+            self.format.update_participations(participations)
+            participations.filter(is_disqualified=True).update(score=-9999)
+            transaction.on_commit(lambda: participations_updated.send(
+                sender=Contest, instance=self, participations=participations))
+    recompute_results.alters_data = True
 
     def is_editable_by(self, user: Profile):
         if user.has_perm('education.edit_all_contest'):
@@ -309,6 +340,18 @@ class ContestParticipation(models.Model):
     virtual = models.IntegerField(_("virtual participation id"), default=LIVE,
                                 help_text=_('0 means non-virtual, otherwise the n-th virtual participation.'))
     format_data = models.JSONField(_("contest format specific data"), null=True, blank=True)
+    rank = models.IntegerField(_("final rank"), null=True, blank=True, default=None,
+                                help_text=_('The rank of a live participation, stored once its contest ended.'))
+
+    RESULT_FIELDS = ('score', 'cumtime', 'tiebreaker', 'is_disqualified', 'format_data')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The loaded results, so that saving can tell which of them changed. Deferred fields are not loaded.
+        instance._loaded_results = {field: instance.__dict__[field] for field in cls.RESULT_FIELDS
+                                    if field in instance.__dict__}
+        return instance
 
     def recompute_results(self):
         with transaction.atomic():
@@ -318,6 +361,14 @@ class ContestParticipation(models.Model):
                 self.save(update_fields=['score'])
     recompute_results.alters_data = True
 
+    def update_results(self, submission):
+        with transaction.atomic():
+            self.contest.format.handle_submission(self, submission)
+            if self.is_disqualified:
+                self.score = -9999
+                self.save(update_fields=['score'])
+    update_results.alters_data = True
+
     def set_disqualified(self, disqualified):
         self.is_disqualified = disqualified
         self.recompute_results()
@@ -388,6 +439,34 @@ class ContestParticipation(models.Model):
         verbose_name_plural = _('contest participations')
 
         unique_together = ('contest', 'user', 'virtual')
+        # The ranking order of live participations, to count and page standings without the Redis scoreboard.
+        indexes = [models.Index(fields=['contest', 'rank']),
+                   models.Index(fields=['contest', 'virtual', 'is_disqualified', '-score', 'cumtime', 'tiebreaker'],
+                                name='education_c_ranking_idx')]
+
+
+class ContestScoreboardSnapshot(models.Model):
+    PERIODIC = 'P'
+    FREEZE = 'F'
+    KINDS = (
+        (PERIODIC, _('Periodic')),
+        (FREEZE, _('Freeze')),
+    )
+
+    contest = models.ForeignKey(Contest, verbose_name=_('contest'), on_delete=models.CASCADE,
+                                related_name='scoreboard_snapshots')
+    time = models.DateTimeField(verbose_name=_('snapshot time'), default=timezone.now)
+    kind = models.CharField(verbose_name=_('snapshot kind'), max_length=1, choices=KINDS, default=PERIODIC)
+    size = models.IntegerField(verbose_name=_('participations'), default=0)
+    data = models.BinaryField(verbose_name=_('packed scoreboard'))
+
+    def __str__(self):
+        return '%s @ %s' % (self.contest.key, self.time)
+
+    class Meta:
+        indexes = [models.Index(fields=['contest', 'time'])]
+        verbose_name = _('scoreboard snapshot')
+        verbose_name_plural = _('scoreboard snapshots')
 
 
 class ContestProblem(models.Model):
@@ -8,6 +8,7 @@ from django.core.validators import RegexValidator, MinValueValidator, MaxValueVa
 from django.core.exceptions import ValidationError
 
 from backend.models import Profile, Organization
+from education.access import get_id_set
 
 def disallowed_characters_validator(text):
     common_disallowed_characters = set(text) & settings.PROBLEM_STATEMENT_DISALLOWED_CHARACTERS
@@ -107,19 +108,21 @@ class Problem(models.Model):
     @classmethod
     def get_visible_problems(cls, user: Profile):
         if not user.is_authenticated:
-            return cls.get_public_problems
+            return cls.get_public_problems()
         
         queryset = cls.objects.defer('description')
         if not (user.has_perm('education.view_private_problem') or user.has_perm('education.edit_all_problem')):
+            from education.visibility import get_problem_grants, public_problems_q
+            grants = get_problem_grants(user)
             q = Q(is_public=True)
             if not (user.has_perm('education.see_organization_problem') or user.has_perm('education.edit_public_problem')):
-                q &= (
-                    Q(is_organization_private=False) or
-                    Q(is_organization_private=True, organizations__in=user.organizations.all())
-                )
-            if user.has_perm('education.edit_own_problem'):
+                q = public_problems_q()
+            ids = set(grants.listed).union(grants.authored)
+            if ids:
+                q |= Q(id__in=ids)
+            if user.has_perm('education.edit_own_problem') and user.admin_of.exists():
                 q |= Q(is_organization_private=True, organizations__in=user.admin_of.all())
-            q |= Q(authors=user)
+                queryset = queryset.distinct()
             queryset = queryset.filter(q)
 
         return queryset
@@ -146,7 +149,9 @@ class Problem(models.Model):
 
     @cached_property
     def author_ids(self):
-        return Problem.authors.through.objects.filter(problem=self).values_list('profile_id', flat=True)
+        return get_id_set('problem', self.id, 'authors', lambda: (
+            Problem.authors.through.objects.filter(problem=self).values_list('profile_id', flat=True)
+        ))
 
     def is_accessible_by(self, user: Profile, skip_contest_problem_check=False):
         # If we don't want to check if the user is in a contest containing that problem.
@@ -169,9 +174,10 @@ class Problem(models.Model):
                 return True
 
             # If the user is in the organization.
-            if user.is_authenticated and \
-                    self.organizations.filter(id__in=user.organizations.all()):
-                return True
+            if user.is_authenticated:
+                from education.visibility import get_problem_grants, has_id
+                if has_id(get_problem_grants(user).listed, self.id):
+                    return True
 
         if not user.is_authenticated:
             return False
@@ -227,6 +233,20 @@ class ProblemType(models.Model):
         unique_together = ('problem', 'group')
 
 
+class ProblemSearchDocument(models.Model):
+    problem = models.OneToOneField(Problem, verbose_name=_("problem"), related_name='search_document',
+                                   primary_key=True, on_delete=models.CASCADE)
+    code = models.CharField(_("problem code"), max_length=20)
+    name = models.CharField(_("problem name"), max_length=100)
+    description = models.TextField(_("problem body"), blank=True)
+    category = models.TextField(_("category"), blank=True)
+    updated = models.DateTimeField(_("last indexed"), auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = _("problem search document")
+        verbose_name_plural = _("problem search documents")
+
+
 class Answer(models.Model):
     types = models.CharField(_("Answer type"), max_length=10, default='mc')
     problem = models.ForeignKey(Problem, verbose_name=_("problem"), related_name='answers', null=True, on_delete=models.CASCADE)
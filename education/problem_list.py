@@ -0,0 +1,60 @@
+"""
+The problem list, which shows the first problems of every level to the user.
+
+The problems shown are fetched in a single query that numbers the listed problems of every level with a window
+function and keeps the first ones, along with the number of problems of their level. The rendered list is cached
+per visibility class, under the stamp of problem visibility, bumped by every change to a problem, and the stamp
+of the list, bumped by changes to levels and categories.
+"""
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from backend.utils.versions import bump_versions, get_versions
+from education.models.problem import Level, Problem
+from education.visibility import PROBLEM_VERSION_KEY, listing_class
+
+__all__ = ['LevelListing', 'get_level_listings', 'problem_list_key', 'invalidate_problem_list']
+
+PROBLEM_LIST_VERSION_KEY = 'problem_list_version'
+
+
+class LevelListing(object):
+    def __init__(self, level, problems, count, limit):
+        self.level = level
+        self.count = count
+        self.has_more = count > limit
+        # Leave room for the link to the rest of the level.
+        self.problems = problems[:limit - 1] if self.has_more else problems
+
+
+def get_level_listings(queryset, limit):
+    """
+    Returns the LevelListing of every level, with at most limit of the problems of queryset in it.
+    """
+    ranked = queryset.only('code', 'name', 'difficult', 'level').annotate(
+        level_row=Window(RowNumber(), partition_by=[F('level')], order_by=[F('code').asc()]),
+        level_count=Window(Count('id'), partition_by=[F('level')]),
+    ).order_by()
+    sql, params = ranked.query.sql_with_params()
+    problems = list(Problem.objects.raw('SELECT * FROM (%s) ranked WHERE ranked.level_row <= %%s '
+                                        'ORDER BY ranked.level_row' % sql, params + (limit,))
+                    .prefetch_related('category'))
+
+    by_level = {}
+    for problem in problems:
+        by_level.setdefault(problem.level_id, []).append(problem)
+    return [LevelListing(level, by_level.get(level.id, []),
+                         by_level[level.id][0].level_count if level.id in by_level else 0, limit)
+            for level in Level.objects.all()]
+
+
+def problem_list_key(user):
+    """
+    Returns the key of the problem list rendered for a user.
+    """
+    versions = get_versions([PROBLEM_VERSION_KEY, PROBLEM_LIST_VERSION_KEY])
+    return '%s:%s:%s' % (listing_class(user), versions[PROBLEM_VERSION_KEY], versions[PROBLEM_LIST_VERSION_KEY])
+
+
+def invalidate_problem_list():
+    bump_versions([PROBLEM_LIST_VERSION_KEY])
@@ -0,0 +1,527 @@
+"""
+A materialized scoreboard of the live participations of every contest, kept in Redis.
+
+Every participation is stored as one member of a sorted set whose members all have the same score, so that
+Redis orders them lexicographically. A member encodes (is_disqualified, -score, cumtime, tiebreaker) in a
+fixed-width, order-preserving form followed by the participation id, which makes lexicographic order equal
+to the ranking order and lets rank lookups use ZLEXCOUNT. A hash maps each participation id to its current
+member, so a participation can be moved without knowing its previous results. Changes are written to the board
+from the moment it starts being built, so that a build never restores the results it read before them.
+
+The rendered cells of every scoreboard row are cached as well, under the version stamp of the participation
+and of its contest, so a row is only rendered again after its participation was saved.
+
+Changes to live participations are published to the contest_<id> channel of the event daemon, so ranking
+pages can patch their rows in place, except while the scoreboard of the contest is frozen.
+
+Once a contest has ended, its standings are finalized: the rank of every live participation is stored on the
+participation, until a change of results clears them again.
+"""
+import logging
+import struct
+from collections import namedtuple
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils.safestring import mark_safe
+
+from backend.utils.ranker import ranker
+from backend.utils.versions import bump_versions, get_versions
+from emath import event
+
+logger = logging.getLogger('education.scoreboard')
+
+SCOREBOARD_TIMEOUT = 86400
+# How long updates keep being written to a board whose build has not finished.
+BUILD_TIMEOUT = 300
+ROW_CACHE_TIMEOUT = 86400
+
+# Tied participations are ordered by id, as they are on the scoreboard.
+RANKING_ORDER = ('is_disqualified', '-score', 'cumtime', 'tiebreaker', 'id')
+
+# rank: the competition rank of a participation.
+# tied: the number of participations sharing this rank, itself included.
+# above, below: the ids of the participations right before and after it in ranking order, nearest last and
+# first respectively.
+Standing = namedtuple('Standing', 'rank tied above below')
+
+_UPSERT = """
+for i = 1, #ARGV, 2 do
+    local old = redis.call('HGET', KEYS[2], ARGV[i])
+    if old then
+        redis.call('ZREM', KEYS[1], old)
+    end
+    redis.call('ZADD', KEYS[1], 0, ARGV[i + 1])
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+"""
+
+# The first build of a board drops what is left of the previous one, which may have outlived its ready key and
+# missed the changes made since, before updates start being written to it. Builds that start while another one
+# is running keep what the updates have written since it started.
+_START_BUILD = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return
+end
+if redis.call('SET', KEYS[4], 1, 'NX', 'EX', ARGV[1]) then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+"""
+
+# Participations updated while the board is being built are already on it with their newer members, and
+# those removed meanwhile are marked by an empty member, so neither is overwritten by the rows read earlier.
+_BUILD = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return
+end
+for i = 1, #ARGV - 1, 2 do
+    if redis.call('HEXISTS', KEYS[2], ARGV[i]) == 0 then
+        redis.call('ZADD', KEYS[1], 0, ARGV[i + 1])
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    end
+end
+local entries = redis.call('HGETALL', KEYS[2])
+for i = 1, #entries, 2 do
+    if entries[i + 1] == '' then
+        redis.call('HDEL', KEYS[2], entries[i])
+    end
+end
+redis.call('SET', KEYS[3], 1)
+redis.call('DEL', KEYS[4])
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[#ARGV])
+end
+"""
+
+_REMOVE = """
+local building = redis.call('EXISTS', KEYS[3]) == 0 and redis.call('EXISTS', KEYS[4]) == 1
+for i = 1, #ARGV do
+    local old = redis.call('HGET', KEYS[2], ARGV[i])
+    if old then
+        redis.call('ZREM', KEYS[1], old)
+    end
+    if building then
+        redis.call('HSET', KEYS[2], ARGV[i], '')
+    elseif old then
+        redis.call('HDEL', KEYS[2], ARGV[i])
+    end
+end
+"""
+
+
+def get_redis():
+    if not settings.EMATH_REDIS_SCOREBOARD:
+        return None
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def _keys(contest_id):
+    base = 'emath:scoreboard:%d' % contest_id
+    return base, base + ':members', base + ':ready', base + ':building'
+
+
+def _float_key(value, descending=False):
+    bits, = struct.unpack('>Q', struct.pack('>d', value + 0.0))
+    bits = bits ^ 0xFFFFFFFFFFFFFFFF if bits >> 63 else bits | 1 << 63
+    if descending:
+        bits ^= 0xFFFFFFFFFFFFFFFF
+    return '%016x' % bits
+
+
+def ranking_key(is_disqualified, score, cumtime, tiebreaker):
+    """
+    Returns a string that sorts in the same order as contest_ranking_list orders participations.
+    Participations with equal keys are tied.
+    """
+    return '%d%s%010d%s' % (is_disqualified, _float_key(score, descending=True), max(int(cumtime), 0),
+                            _float_key(tiebreaker))
+
+
+def _member(participation):
+    return '%s:%010d' % (ranking_key(participation.is_disqualified, participation.score, participation.cumtime,
+                                  participation.tiebreaker), participation.id)
+
+
+def _member_id(member):
+    return int(member.rsplit(b':', 1)[1])
+
+
+def update_participations(contest_id, participations):
+    """
+    Moves participations to their current place on the scoreboard. Participations that are not live are
+    removed from it instead. Does nothing while the scoreboard of the contest is neither materialized nor
+    being built.
+    """
+    redis = get_redis()
+    if redis is None:
+        return
+    board, members, ready, building = _keys(contest_id)
+    live, gone = [], []
+    for participation in participations:
+        if participation.virtual == 0:
+            live += [participation.id, _member(participation)]
+        else:
+            gone.append(participation.id)
+    try:
+        if not redis.exists(ready, building):
+            return
+        if live:
+            redis.eval(_UPSERT, 2, board, members, *live)
+        if gone:
+            redis.eval(_REMOVE, 4, board, members, ready, building, *gone)
+    except Exception:
+        logger.exception('Failed to update scoreboard of contest %d', contest_id)
+
+
+def remove_participations(contest_id, participation_ids):
+    redis = get_redis()
+    if redis is None or not participation_ids:
+        return
+    try:
+        redis.eval(_REMOVE, 4, *(_keys(contest_id) + tuple(participation_ids)))
+    except Exception:
+        logger.exception('Failed to update scoreboard of contest %d', contest_id)
+
+
+def invalidate(contest_id):
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        redis.delete(*_keys(contest_id))
+    except Exception:
+        logger.exception('Failed to invalidate scoreboard of contest %d', contest_id)
+
+
+def _build(redis, contest):
+    board, members, ready, building = _keys(contest.id)
+    # Updates are written to the board from now on, even before the rows below are read.
+    redis.eval(_START_BUILD, 4, board, members, ready, building, BUILD_TIMEOUT)
+    args = []
+    for participation in _live_participations(contest).only('id', 'virtual', 'is_disqualified', 'score',
+                                                              'cumtime', 'tiebreaker').iterator():
+        args += [participation.id, _member(participation)]
+    redis.eval(_BUILD, 4, board, members, ready, building, *(args + [SCOREBOARD_TIMEOUT]))
+
+
+def _ready_board(redis, contest):
+    board, members, ready, building = _keys(contest.id)
+    if not redis.exists(ready):
+        _build(redis, contest)
+    return board
+
+
+def get_ranking(contest, start=0, stop=-1):
+    """
+    Returns the ids of the live participations of a contest in ranking order, from position start to
+    position stop inclusive, or None if the scoreboard is unavailable.
+    """
+    redis = get_redis()
+    if redis is None:
+        return None
+    try:
+        return [_member_id(member) for member in redis.zrange(_ready_board(redis, contest), start, stop)]
+    except Exception:
+        logger.exception('Failed to read scoreboard of contest %d', contest.id)
+        return None
+
+
+def _live_participations(contest):
+    return contest.users.filter(virtual=0)
+
+
+def count_participations(contest):
+    redis = get_redis()
+    if redis is not None:
+        try:
+            return redis.zcard(_ready_board(redis, contest))
+        except Exception:
+            logger.exception('Failed to read scoreboard of contest %d', contest.id)
+    return _live_participations(contest).count()
+
+
+def count_ahead(contest, participation):
+    """
+    Returns the number of live participations ranked strictly ahead of a participation, so that its
+    rank is this number plus one.
+    """
+    redis = get_redis()
+    if redis is not None:
+        key = ranking_key(participation.is_disqualified, participation.score, participation.cumtime,
+                          participation.tiebreaker)
+        try:
+            return redis.zlexcount(_ready_board(redis, contest), '-', '(' + key)
+        except Exception:
+            logger.exception('Failed to read scoreboard of contest %d', contest.id)
+
+    return _live_participations(contest).filter(_ahead_q(participation)).count()
+
+
+def _tied_q(participation):
+    return Q(is_disqualified=participation.is_disqualified, score=participation.score,
+             cumtime=participation.cumtime, tiebreaker=participation.tiebreaker)
+
+
+def _ahead_q(participation):
+    disqualified, score = participation.is_disqualified, participation.score
+    return (Q(is_disqualified__lt=disqualified) |
+            Q(is_disqualified=disqualified, score__gt=score) |
+            Q(is_disqualified=disqualified, score=score, cumtime__lt=participation.cumtime) |
+            Q(is_disqualified=disqualified, score=score, cumtime=participation.cumtime,
+              tiebreaker__lt=participation.tiebreaker))
+
+
+def _redis_standing(redis, contest, participation, neighbours):
+    board = _ready_board(redis, contest)
+    key = ranking_key(participation.is_disqualified, participation.score, participation.cumtime,
+                      participation.tiebreaker)
+    with redis.pipeline(transaction=True) as pipe:
+        pipe.zrank(board, _member(participation))
+        pipe.zlexcount(board, '-', '(' + key)
+        pipe.zlexcount(board, '[' + key + ':', '(' + key + ';')
+        position, ahead, tied = pipe.execute()
+    if position is None:
+        return None
+    above = redis.zrange(board, max(position - neighbours, 0), position - 1) if position else []
+    below = redis.zrange(board, position + 1, position + neighbours)
+    return Standing(ahead + 1, tied, [_member_id(member) for member in above],
+                    [_member_id(member) for member in below])
+
+
+def get_standing(contest, participation, neighbours=2):
+    """
+    Returns the Standing of a live participation, looking up only the participation itself and its
+    neighbours on the scoreboard, or with counting queries over the ranking index.
+    """
+    redis = get_redis()
+    if redis is not None:
+        try:
+            standing = _redis_standing(redis, contest, participation, neighbours)
+        except Exception:
+            logger.exception('Failed to read scoreboard of contest %d', contest.id)
+        else:
+            if standing is not None:
+                return standing
+
+    queryset = _live_participations(contest)
+    tied = queryset.filter(_tied_q(participation))
+    above = queryset.filter(_ahead_q(participation) | _tied_q(participation) & Q(id__lt=participation.id))
+    below = queryset.exclude(id=participation.id).exclude(_ahead_q(participation)) \
+                    .exclude(_tied_q(participation) & Q(id__lt=participation.id))
+    reverse = tuple(field[1:] if field.startswith('-') else '-' + field for field in RANKING_ORDER)
+    return Standing(
+        rank=count_ahead(contest, participation) + 1,
+        tied=tied.count(),
+        above=list(above.order_by(*reverse).values_list('id', flat=True)[:neighbours])[::-1],
+        below=list(below.order_by(*RANKING_ORDER).values_list('id', flat=True)[:neighbours]),
+    )
+
+
+def _results(participation):
+    return participation.is_disqualified, participation.score, participation.cumtime, participation.tiebreaker
+
+
+def neighbour_ranks(contest, participation, standing, participations):
+    """
+    Returns the ranks of the neighbours of a live participation on its Standing, by participation id, counted
+    from the rank of the participation and their positions next to it. Only the rank of the farthest group of
+    tied participations above it may need counting, as it may continue beyond the neighbours.
+    :param participations: The neighbouring participations by id, as ContestParticipation objects.
+    """
+    own = _results(participation)
+    ranks = {}
+
+    # The first participation below that is not tied with this one comes after its whole tie group.
+    position, last, rank = None, own, standing.rank
+    for id in standing.below:
+        if id not in participations:
+            continue
+        results = _results(participations[id])
+        if results != own:
+            position = standing.rank - 1 + standing.tied if position is None else position + 1
+            if results != last:
+                rank = position + 1
+        ranks[id], last = rank, results
+
+    # Above, positions go up from the end of the tie group ahead of this participation.
+    position, groups = standing.rank - 1, []
+    for id in reversed(standing.above):
+        if id not in participations:
+            continue
+        results = _results(participations[id])
+        if results == own:
+            ranks[id] = standing.rank
+            continue
+        position -= 1
+        if groups and groups[-1][0] == results:
+            groups[-1][1].append(id)
+            groups[-1][2] = position
+        else:
+            groups.append([results, [id], position])
+    for index, (results, ids, top) in enumerate(groups):
+        if index + 1 < len(groups) or top == 0:
+            rank = top + 1
+        else:
+            rank = count_ahead(contest, participations[ids[0]]) + 1
+        for id in ids:
+            ranks[id] = rank
+    return ranks
+
+
+class RankingIds(object):
+    """
+    The ids of the live participations of a contest in ranking order, as a lazy sequence that can be
+    paginated. Only the requested slice is read, from the scoreboard or else from the database.
+    """
+
+    def __init__(self, contest):
+        self.contest = contest
+
+    def count(self):
+        return count_participations(self.contest)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('RankingIds only supports slicing without step')
+        start, stop = index.start or 0, index.stop
+        ids = get_ranking(self.contest, start, -1 if stop is None else stop - 1)
+        if ids is None:
+            ids = list(_live_participations(self.contest).order_by(*RANKING_ORDER)
+                       .values_list('id', flat=True)[start:stop])
+        return ids
+
+
+def finalize_ranks(contest):
+    """
+    Stores the rank of every live participation of an ended contest on the participation itself, so that
+    its standings are read in pages from the (contest, rank) index.
+    """
+    queryset = _live_participations(contest)
+    with transaction.atomic():
+        rows = queryset.order_by(*RANKING_ORDER).values_list('id', 'score', 'cumtime', 'tiebreaker')
+        ranked = [queryset.model(id=id, rank=rank) for rank, (id, score, cumtime, tiebreaker)
+                  in ranker(rows.iterator(), key=itemgetter(1, 2, 3))]
+        queryset.model.objects.bulk_update(ranked, ['rank'], batch_size=1000)
+
+
+def clear_ranks(contest):
+    """
+    Forgets the stored ranks of a contest after its standings changed, until it is finalized again.
+    """
+    contest.users.filter(rank__isnull=False).update(rank=None)
+
+
+def has_final_ranks(contest):
+    return contest.ended and not _live_participations(contest).filter(rank__isnull=True).exists()
+
+
+def final_ranking(contest):
+    """
+    Returns the live participations of a finalized contest in ranking order.
+    """
+    return _live_participations(contest).order_by('rank', 'id')
+
+
+def _participation_version_key(participation_id):
+    return 'contest_participation_version:%d' % participation_id
+
+
+def _rows_version_key(contest_id):
+    return 'contest_rows_version:%d' % contest_id
+
+
+def invalidate_rows(contest_id, participation_ids=None):
+    """
+    Drops the cached rows of some participations, or of every participation of the contest if
+    participation_ids is None.
+    """
+    if participation_ids is None:
+        bump_versions([_rows_version_key(contest_id)])
+    else:
+        bump_versions([_participation_version_key(participation_id) for participation_id in participation_ids])
+
+
+def get_row_cells(contest, participations, render):
+    """
+    Returns the rendered (result cell, problem cells) of every participation, in order. Rows missing from the
+    cache are rendered with render(participation), which must return the result cell and the list of problem
+    cells, and are then cached.
+    """
+    rows_version = _rows_version_key(contest.id)
+    versions = get_versions([rows_version] + [_participation_version_key(participation.id)
+                                              for participation in participations])
+    keys = ['contest_row:%d:%s:%s:%d' % (participation.id, versions[_participation_version_key(participation.id)],
+                                         versions[rows_version], contest.points_precision)
+            for participation in participations]
+
+    cached = cache.get_many(keys)
+    missing = {}
+    cells = []
+    for key, participation in zip(keys, participations):
+        if key in cached:
+            result_cell, problem_cells = cached[key]
+        else:
+            result_cell, problem_cells = render(participation)
+            result_cell, problem_cells = str(result_cell), ''.join(map(str, problem_cells))
+            missing[key] = (result_cell, problem_cells)
+        cells.append((mark_safe(result_cell), mark_safe(problem_cells)))
+    if missing:
+        cache.set_many(missing, ROW_CACHE_TIMEOUT)
+    return cells
+
+
+def _channel(contest_id):
+    return 'contest_%d' % contest_id
+
+
+def _display_user_problem(contest, participation, contest_problem):
+    try:
+        return contest.format.display_user_problem(participation, contest_problem)
+    except (KeyError, TypeError, ValueError):
+        return mark_safe('<td>???</td>')
+
+
+def publish_participation(participation, previous):
+    """
+    Posts the changed results of a live participation to its contest's channel, with the rendered result cell
+    and the rendered cells of the problems whose format data changed.
+    :param previous: The participation's results before the change, keyed by field name, as stored by
+                     ContestParticipation.from_db. Fields missing from it are treated as changed.
+    """
+    if not settings.EVENT_DAEMON_USE or participation.virtual != 0 or participation.contest.is_frozen:
+        return
+    current = {field: getattr(participation, field) for field in participation.RESULT_FIELDS}
+    if all(field in previous and previous[field] == value for field, value in current.items()):
+        return
+
+    contest = participation.contest
+    problems = contest.contest_problems.all()
+    if 'format_data' in previous:
+        data, old_data = current['format_data'] or {}, previous['format_data'] or {}
+        changed = [key for key in set(data) | set(old_data) if data.get(key) != old_data.get(key)]
+        problems = problems.filter(id__in=changed) if changed else []
+    event.post(_channel(contest.id), {
+        'type': 'update',
+        'participation': participation.id,
+        'score': participation.score,
+        'cumtime': participation.cumtime,
+        'tiebreaker': participation.tiebreaker,
+        'disqualified': participation.is_disqualified,
+        'result': str(contest.format.display_participation_result(participation)),
+        'cells': {problem.id: str(_display_user_problem(contest, participation, problem)) for problem in problems},
+    })
+
+
+def publish_reload(contest_id):
+    """
+    Tells ranking pages of a contest to reload, after the results of many participations changed at once.
+    """
+    if settings.EVENT_DAEMON_USE:
+        event.post(_channel(contest_id), {'type': 'reload'})
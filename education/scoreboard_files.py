@@ -0,0 +1,96 @@
+"""
+Scoreboards of running public contests, written as static JSON files so that anonymous spectators are served
+by the web server instead of Django.
+
+A background job writes <contest key>.json, and a gzipped copy next to it, into EMATH_SCOREBOARD_JSON_ROOT
+every EMATH_SCOREBOARD_JSON_INTERVAL seconds, replacing the previous files atomically. The file holds the rows
+an anonymous user would see, so it follows the freeze of the scoreboard like the ranking page does.
+"""
+import gzip
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.paginator import Paginator
+from django.template.loader import get_template
+from django.utils import timezone
+
+__all__ = ['is_public', 'scoreboard_path', 'scoreboard_url', 'write_scoreboard']
+
+# Spectators fall back to the ranking page if the job stopped refreshing a scoreboard for this many intervals.
+STALE_INTERVALS = 5
+
+
+def is_public(contest):
+    """
+    Returns whether anonymous users can see the full scoreboard of a contest.
+    """
+    user = AnonymousUser()
+    return contest.is_accessible_by(user) and contest.can_see_full_scoreboard(user)
+
+
+def scoreboard_path(contest):
+    return os.path.join(settings.EMATH_SCOREBOARD_JSON_ROOT, '%s.json' % contest.key)
+
+
+def scoreboard_url(contest):
+    """
+    Returns the URL of the published scoreboard of a running public contest, or None if the ranking page
+    should be rendered by Django.
+    """
+    if not settings.EMATH_SCOREBOARD_JSON_ROOT or not contest.can_join or contest.ended or not is_public(contest):
+        return None
+    try:
+        modified = os.stat(scoreboard_path(contest)).st_mtime
+    except OSError:
+        return None
+    interval = settings.EMATH_SCOREBOARD_JSON_INTERVAL
+    if modified < timezone.now().timestamp() - interval * STALE_INTERVALS:
+        return None
+    return '%s%s.json' % (settings.EMATH_SCOREBOARD_JSON_URL, contest.key)
+
+
+def _ranking(contest):
+    from education.snapshots import get_freeze_snapshot
+    from education.views.contest import get_contest_ranking_list, snapshot_ranking_page
+
+    if contest.can_see_unfrozen_scoreboard(AnonymousUser()):
+        return get_contest_ranking_list(None, contest, show_current_virtual=False)[0]
+    snapshot = get_freeze_snapshot(contest)
+    page = Paginator(snapshot.ids, max(len(snapshot.ids), 1)).page(1)
+    return get_contest_ranking_list(None, contest, show_current_virtual=False,
+                                    ranking_list=lambda contest, problems: snapshot_ranking_page(
+                                        contest, problems, page=page, snapshot=snapshot),
+                                    ranker=lambda users, key: users)[0]
+
+
+def _replace(path, data):
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def write_scoreboard(contest):
+    """
+    Writes the scoreboard of a contest, as its ranking page would show it to anonymous users.
+    """
+    row = get_template('contest/row.html')
+    data = json.dumps({
+        'time': timezone.now().isoformat(),
+        'frozen': contest.is_frozen,
+        'rows': [row.render({'rank': rank, 'user': user, 'contest': contest}) for rank, user in _ranking(contest)],
+    }).encode('utf-8')
+
+    path = scoreboard_path(contest)
+    if settings.EMATH_SCOREBOARD_JSON_GZIP:
+        _replace(path + '.gz', gzip.compress(data, mtime=0))
+    _replace(path, data)
+
@@ -0,0 +1,188 @@
+"""
+Full-text search of problems by their code, name, body and categories.
+
+Every problem has a ProblemSearchDocument holding its searchable text, rewritten whenever the problem or its
+categories change. The documents are indexed by the database when it can: on SQLite by an FTS5 table kept in
+sync with them by triggers, and on MySQL by a FULLTEXT index over them. Other databases, and SQLite builds
+without FTS5, are searched through an inverted index built in every process, which picks up the documents
+indexed since it last looked before each search.
+
+Searches match the problems containing every word of the term, words being matched as prefixes, and return at
+most MAX_RESULTS of them, best matches first. Matches are restricted to the problems the caller may list within
+the search itself, so that problems they can not see never take the place of those they can.
+"""
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+
+from education.models.problem import Problem, ProblemSearchDocument
+
+__all__ = ['index_problems', 'search_problems']
+
+MAX_RESULTS = 500
+FTS_TABLE = 'education_problemsearch_fts'
+
+# The weights of the fields of a document, in the order of the columns of the FTS5 table.
+FIELDS = ('code', 'name', 'description', 'category')
+WEIGHTS = (10.0, 5.0, 1.0, 2.0)
+
+# Documents indexed this long before the last refresh of the in-process index are indexed again, so that
+# those committed late by slow transactions are not missed.
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+_word = re.compile(r'\w+')
+
+
+def _words(text):
+    return _word.findall(text)
+
+
+def _fold(word):
+    # Matches what unicode61 with remove_diacritics does to the words of FTS5 tables.
+    return ''.join(char for char in unicodedata.normalize('NFKD', word.lower())
+                   if not unicodedata.combining(char))
+
+
+def _category_text(problem):
+    return ' '.join('%s %s' % (group.name, group.short_name) for group in problem.category.all())
+
+
+def index_problems(problem_ids):
+    """
+    Rewrites the search documents of problems, and drops those of problems that no longer exist.
+    """
+    problem_ids = list(problem_ids)
+    problems = Problem.objects.filter(id__in=problem_ids).only('code', 'name', 'description') \
+                              .prefetch_related('category')
+    documents = [ProblemSearchDocument(problem=problem, code=problem.code, name=problem.name,
+                                       description=problem.description, category=_category_text(problem))
+                 for problem in problems]
+    with transaction.atomic():
+        ProblemSearchDocument.objects.filter(problem_id__in=problem_ids).delete()
+        ProblemSearchDocument.objects.bulk_create(documents)
+
+
+def _ids_sql(queryset):
+    # The query of the ids of the problems of queryset, to restrict matches to them in SQL.
+    sql, params = queryset.order_by().values('id').query.sql_with_params()
+    return sql, list(params)
+
+
+class SQLiteSearch(object):
+    def search(self, words, queryset, limit):
+        match = ' '.join('"%s"*' % word for word in words)
+        ids_sql, ids_params = _ids_sql(queryset)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM {0} WHERE {0} MATCH %s AND rowid IN ({1}) '
+                           'ORDER BY bm25({0}, {2}) LIMIT %s'.format(FTS_TABLE, ids_sql,
+                                                                    ', '.join(map(str, WEIGHTS))),
+                           [match] + ids_params + [limit])
+            return [id for id, in cursor.fetchall()]
+
+
+class MySQLSearch(object):
+    def search(self, words, queryset, limit):
+        match = ' '.join('+%s*' % word for word in words)
+        ids_sql, ids_params = _ids_sql(queryset)
+        table = connection.ops.quote_name(ProblemSearchDocument._meta.db_table)
+        against = 'MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % ', '.join(FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT problem_id FROM %s WHERE %s AND problem_id IN (%s) ORDER BY %s DESC LIMIT %%s'
+                           % (table, against, ids_sql, against), [match] + ids_params + [match, limit])
+            return [id for id, in cursor.fetchall()]
+
+
+class MemorySearch(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refreshed = None
+        # word -> {problem id: weight}, and the weight of every word of every problem, to unindex it.
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.words = []
+
+    def _add(self, document):
+        self._remove(document.problem_id)
+        weights = defaultdict(float)
+        for field, weight in zip(FIELDS, WEIGHTS):
+            for word in _words(getattr(document, field)):
+                weights[_fold(word)] += weight
+        for word, weight in weights.items():
+            self.postings[word][document.problem_id] = weight
+        self.documents[document.problem_id] = weights
+
+    def _remove(self, problem_id):
+        for word in self.documents.pop(problem_id, ()):
+            del self.postings[word][problem_id]
+
+    def refresh(self):
+        documents = ProblemSearchDocument.objects.all()
+        if self.refreshed is not None:
+            documents = documents.filter(updated__gte=self.refreshed - REFRESH_OVERLAP)
+        documents = list(documents)
+        for document in documents:
+            self._add(document)
+        if documents:
+            self.refreshed = max(document.updated for document in documents)
+            self.words = sorted(word for word, posting in self.postings.items() if posting)
+
+    def _matches(self, word):
+        # The weights of the problems with a word starting with word, by their best matching word.
+        matches = {}
+        index = bisect_left(self.words, word)
+        while index < len(self.words) and self.words[index].startswith(word):
+            for problem_id, weight in self.postings[self.words[index]].items():
+                matches[problem_id] = max(weight, matches.get(problem_id, 0))
+            index += 1
+        return matches
+
+    def search(self, words, queryset, limit):
+        visible = set(queryset.values_list('id', flat=True))
+        with self.lock:
+            self.refresh()
+            total = len(self.documents)
+            scores = None
+            for word in map(_fold, words):
+                matches = self._matches(word)
+                idf = math.log(1 + total / max(len(matches), 1))
+                if scores is None:
+                    scores = {problem_id: weight * idf for problem_id, weight in matches.items()
+                              if problem_id in visible}
+                else:
+                    scores = {problem_id: score + matches[problem_id] * idf
+                              for problem_id, score in scores.items() if problem_id in matches}
+        return sorted(scores, key=lambda problem_id: (-scores[problem_id], problem_id))[:limit]
+
+
+_backend = None
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        if connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+            _backend = SQLiteSearch()
+        elif connection.vendor == 'mysql':
+            _backend = MySQLSearch()
+        else:
+            _backend = MemorySearch()
+    return _backend
+
+
+def search_problems(queryset, term):
+    """
+    Returns the problems of queryset matching a search term, best matches first, or all of them ordered by
+    code if the term has no words.
+    """
+    words = _words(term)
+    if not words:
+        return queryset.order_by('code')
+    ids = _get_backend().search(words, queryset, MAX_RESULTS)
+    problems = queryset.filter(id__in=ids).in_bulk()
+    return [problems[id] for id in ids if id in problems]
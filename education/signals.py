@@ -4,10 +4,21 @@ import errno
 from django.conf import settings
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
-from education.models.contest import ContestProblem
+from backend.models import Profile
+from education import scoreboard
+from education.access import invalidate_contest_access, invalidate_id_sets, invalidate_user_access
+from education.grading import invalidate_answer_entries
+from education.models.contest import ContestParticipation, ContestProblem, participations_updated
+from education.models.problem import Answer, Level, ProblemGroup, ProblemType
+from education.problem_list import invalidate_problem_list
+from education.search import index_problems
+from education.tasks import schedule_finalization, schedule_freeze_snapshot
+from education.timeline import invalidate_timeline
+from education.visibility import invalidate_contest_visibility, invalidate_problem_visibility
 
 from .models import Problem, Contest
 
@@ -22,15 +33,181 @@ def unlink_if_exists(file):
             raise
 
 @receiver(post_save, sender=Contest)
-def contest_update(sender, instance, **kwargs):
+def contest_update(sender, instance, update_fields=None, **kwargs):
   cache.delete_many([make_template_fragment_key('problem_html', (problem.problem.id, 'jax'))
                     for problem in ContestProblem.objects.filter(contest=instance)])
   unlink_if_exists(get_pdf_path('%s.pdf' % (instance.key)))
+  # Counting the participants of a contest changes neither its scoreboard nor who may see it.
+  if update_fields is not None and set(update_fields) == {'user_count'}:
+    return
+  transaction.on_commit(lambda: scoreboard.invalidate_rows(instance.id))
+  transaction.on_commit(lambda: invalidate_contest_access([instance.id]))
+  transaction.on_commit(invalidate_contest_visibility)
+  transaction.on_commit(lambda: schedule_freeze_snapshot(instance))
+  if not instance.ended:
+    transaction.on_commit(lambda: schedule_finalization(instance))
+
+
+def refinalize(contest):
+  # The standings of an ended contest changed, so its stored ranks are stale.
+  if contest.ended:
+    scoreboard.clear_ranks(contest)
+    schedule_finalization(contest)
+
+
+@receiver(post_delete, sender=Contest)
+def contest_delete(sender, instance, **kwargs):
+  transaction.on_commit(invalidate_contest_visibility)
+
+
+def m2m_owner_ids(field, instance, action, reverse, pk_set):
+  # The ids of the objects on the side of a many-to-many field whose relation changed, from either side.
+  if not reverse:
+    return [instance.pk] if action.startswith('post_') else []
+  if action in ('post_add', 'post_remove'):
+    return list(pk_set)
+  if action == 'pre_clear':
+    return list(field.remote_field.through.objects.filter(**{field.m2m_reverse_field_name(): instance.pk})
+                                                  .values_list(field.m2m_column_name(), flat=True))
+  return []
+
+
+CONTEST_ACCESS_RELATIONS = {field.remote_field.through: field for field in map(Contest._meta.get_field, (
+  'authors', 'curators', 'organizations', 'private_contestants', 'view_contest_scoreboard'))}
+USER_ACCESS_RELATIONS = {field.remote_field.through: field for field in map(Profile._meta.get_field, (
+  'organizations', 'groups', 'user_permissions'))}
+
+
+@receiver(m2m_changed)
+def access_relation_update(sender, instance, action, reverse, pk_set, **kwargs):
+  if sender in CONTEST_ACCESS_RELATIONS:
+    contest_ids = m2m_owner_ids(CONTEST_ACCESS_RELATIONS[sender], instance, action, reverse, pk_set)
+    if contest_ids:
+      transaction.on_commit(lambda: invalidate_contest_access(contest_ids))
+      transaction.on_commit(invalidate_contest_visibility)
+      if sender in (Contest.authors.through, Contest.curators.through):
+        transaction.on_commit(lambda: invalidate_id_sets('contest', contest_ids))
+  elif sender is Problem.authors.through:
+    problem_ids = m2m_owner_ids(Problem._meta.get_field('authors'), instance, action, reverse, pk_set)
+    if problem_ids:
+      transaction.on_commit(lambda: invalidate_id_sets('problem', problem_ids))
+      transaction.on_commit(invalidate_problem_visibility)
+  elif sender is Problem.organizations.through:
+    if m2m_owner_ids(Problem._meta.get_field('organizations'), instance, action, reverse, pk_set):
+      transaction.on_commit(invalidate_problem_visibility)
+  elif sender in USER_ACCESS_RELATIONS:
+    user_ids = m2m_owner_ids(USER_ACCESS_RELATIONS[sender], instance, action, reverse, pk_set)
+    if user_ids:
+      transaction.on_commit(lambda: invalidate_user_access(user_ids))
+
+
+@receiver(post_save, sender=Profile)
+def profile_update(sender, instance, update_fields=None, **kwargs):
+  # Logging in and joining contests do not change what the user may access.
+  if update_fields is None or not set(update_fields) <= {'last_login', 'current_contest'}:
+    transaction.on_commit(lambda: invalidate_user_access([instance.id]))
 
 
 @receiver(post_save, sender=Problem)
 def problem_update(sender, instance, **kwargs):
   cache.delete_many([make_template_fragment_key('problem_html', (instance.id, 'jax'))])
+  transaction.on_commit(invalidate_problem_visibility)
+  transaction.on_commit(lambda: index_problems([instance.id]))
 
   for contest in ContestProblem.objects.filter(problem=instance):
     unlink_if_exists(get_pdf_path('%s.pdf' % (contest.contest.key)))
+
+
+@receiver(post_delete, sender=Problem)
+def problem_delete(sender, instance, **kwargs):
+  transaction.on_commit(invalidate_problem_visibility)
+
+
+@receiver([post_save, post_delete], sender=Problem)
+def problem_answer_key_update(sender, instance, **kwargs):
+  # Deleting the problem clears its id before the transaction commits.
+  problem_ids = [instance.id]
+  transaction.on_commit(lambda: invalidate_answer_entries(problem_ids))
+
+
+@receiver([post_save, post_delete], sender=Answer)
+def answer_update(sender, instance, **kwargs):
+  if instance.problem_id is not None:
+    transaction.on_commit(lambda: invalidate_answer_entries([instance.problem_id]))
+
+
+@receiver([post_save, post_delete], sender=Level)
+@receiver([post_save, post_delete], sender=ProblemGroup)
+@receiver([post_save, post_delete], sender=ProblemType)
+def problem_list_update(sender, instance, **kwargs):
+  transaction.on_commit(invalidate_problem_list)
+
+
+@receiver(m2m_changed, sender=Problem.category.through)
+def problem_category_update(sender, instance, action, reverse, pk_set, **kwargs):
+  if action.startswith('post_'):
+    transaction.on_commit(invalidate_problem_list)
+  problem_ids = m2m_owner_ids(Problem._meta.get_field('category'), instance, action, reverse, pk_set)
+  if problem_ids:
+    transaction.on_commit(lambda: index_problems(problem_ids))
+
+
+@receiver([post_save, post_delete], sender=ProblemType)
+def problem_type_update(sender, instance, **kwargs):
+  transaction.on_commit(lambda: index_problems([instance.problem_id]))
+
+
+@receiver(post_save, sender=ProblemGroup)
+def problem_group_update(sender, instance, **kwargs):
+  transaction.on_commit(lambda: index_problems(ProblemType.objects.filter(group_id=instance.id)
+                                                                  .values_list('problem_id', flat=True)))
+
+
+@receiver(post_save, sender=ContestParticipation)
+def participation_update(sender, instance, created=False, **kwargs):
+  previous = getattr(instance, '_loaded_results', {})
+  instance._loaded_results = {field: instance.__dict__[field] for field in instance.RESULT_FIELDS
+                              if field in instance.__dict__}
+
+  def update():
+    scoreboard.update_participations(instance.contest_id, [instance])
+    scoreboard.invalidate_rows(instance.contest_id, [instance.id])
+    scoreboard.publish_participation(instance, previous)
+    if instance.virtual == ContestParticipation.LIVE:
+      if created:
+        invalidate_user_access([instance.user_id])
+      invalidate_timeline(instance.contest_id)
+      if any(previous.get(field) != value for field, value in instance._loaded_results.items()):
+        refinalize(instance.contest)
+  transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=ContestParticipation)
+def participation_delete(sender, instance, **kwargs):
+  # Deleting the participation clears its id before the transaction commits.
+  participation_id = instance.id
+
+  def delete():
+    scoreboard.remove_participations(instance.contest_id, [participation_id])
+    if instance.virtual == ContestParticipation.LIVE:
+      invalidate_user_access([instance.user_id])
+    # The contest itself may be what was deleted.
+    contest = Contest.objects.filter(id=instance.contest_id).first()
+    if instance.virtual == ContestParticipation.LIVE and contest is not None:
+      refinalize(contest)
+  transaction.on_commit(delete)
+
+
+@receiver(participations_updated, sender=Contest)
+def participations_bulk_update(sender, instance, participations, **kwargs):
+  scoreboard.invalidate_rows(instance.id)
+  invalidate_timeline(instance.id)
+  scoreboard.update_participations(instance.id, participations.only(
+    'id', 'virtual', 'is_disqualified', 'score', 'cumtime', 'tiebreaker'))
+  scoreboard.publish_reload(instance.id)
+  refinalize(instance)
+
+
+@receiver([post_save, post_delete], sender=ContestProblem)
+def contest_problem_update(sender, instance, **kwargs):
+  transaction.on_commit(lambda: scoreboard.invalidate_rows(instance.contest_id))
@@ -0,0 +1,212 @@
+"""
+Scoreboard snapshots of contests, stored as zlib-compressed packed arrays of the participation id, rank,
+score and cumulative time of every live participation, in ranking order.
+
+The snapshot of a frozen scoreboard is not a capture of the live standings, which may already include results
+submitted after the freeze, but the standings at the freeze time replayed from the answers submitted until then.
+It is replayed once per contest, by whichever of the freeze task and the ranking pages needs it first.
+"""
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import lru_cache
+from operator import itemgetter
+
+from django.db import transaction
+from django.utils import timezone
+
+from backend.utils.ranker import ranker
+from education.models.contest import Contest, ContestScoreboardSnapshot
+from education.scoreboard import RANKING_ORDER, Standing
+
+__all__ = ['Snapshot', 'pack', 'unpack', 'take_snapshot', 'take_freeze_snapshot', 'get_snapshot',
+           'get_freeze_snapshot', 'store_freeze_snapshot', 'get_nearest_snapshot', 'snapshot_standing']
+
+_HEADER = struct.Struct('<4sI')
+_MAGIC = b'SB01'
+# typecode of every packed array, in storage order.
+_ARRAYS = ('L', 'L', 'd', 'L')
+
+# ids, ranks, scores, cumtimes: arrays indexed by ranking position.
+Snapshot = namedtuple('Snapshot', 'id time kind ids ranks scores cumtimes')
+
+
+def _array(typecode, values=()):
+    # 'L' is 8 bytes wide on some platforms, so use whichever unsigned type holds exactly 4 bytes.
+    if typecode == 'L' and array('L').itemsize != 4:
+        typecode = 'I'
+    return array(typecode, values)
+
+
+def pack(rows):
+    """
+    Packs (participation id, rank, score, cumtime) rows into a compressed byte string.
+    """
+    columns = [_array(typecode) for typecode in _ARRAYS]
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    return zlib.compress(_HEADER.pack(_MAGIC, len(columns[0])) + b''.join(column.tobytes() for column in columns))
+
+
+def unpack(data):
+    """
+    Returns the (ids, ranks, scores, cumtimes) arrays of a packed scoreboard.
+    """
+    data = zlib.decompress(data)
+    magic, size = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError('not a packed scoreboard')
+    columns, offset = [], _HEADER.size
+    for typecode in _ARRAYS:
+        column = _array(typecode)
+        length = size * column.itemsize
+        column.frombytes(data[offset:offset + length])
+        if sys.byteorder != 'little':
+            column.byteswap()
+        columns.append(column)
+        offset += length
+    return tuple(columns)
+
+
+def _store(contest, time, kind, rows):
+    # rows: (id, score, cumtime, tiebreaker) of every live participation, in ranking order.
+    packed = [(id, rank, score, cumtime) for rank, (id, score, cumtime, tiebreaker)
+              in ranker(rows, key=itemgetter(1, 2, 3))]
+    return ContestScoreboardSnapshot.objects.create(contest=contest, time=time, kind=kind, size=len(packed),
+                                                    data=pack(packed))
+
+
+def take_snapshot(contest, kind=ContestScoreboardSnapshot.PERIODIC):
+    """
+    Stores the current scoreboard of the live participations of a contest.
+    """
+    time = timezone.now()
+    rows = contest.users.filter(virtual=0).order_by(*RANKING_ORDER) \
+                  .values_list('id', 'score', 'cumtime', 'tiebreaker').iterator()
+    return _store(contest, time, kind, rows)
+
+
+def take_freeze_snapshot(contest):
+    """
+    Stores the scoreboard of the live participations of a contest as it was at its freeze time, replayed from
+    the answers submitted until then, whenever this runs. Returns None if the format of the contest can not
+    replay results.
+    """
+    participations = contest.users.filter(virtual=0)
+    try:
+        steps = contest.format.get_results_timeline(participations)
+    except NotImplementedError:
+        return None
+
+    freeze = (contest.freeze_time - contest.start_time).total_seconds()
+    rows = []
+    for id, is_disqualified in participations.values_list('id', 'is_disqualified'):
+        score, cumtime = 0, 0
+        # Steps happen when their answers were submitted, so answers to attempts opened before the freeze but
+        # submitted after it are left out.
+        for elapsed, step_score, step_cumtime in steps.get(id, ()):
+            if elapsed > freeze:
+                break
+            score, cumtime = step_score, int(step_cumtime)
+        if is_disqualified:
+            score = -9999
+        # Replayed results have no tiebreaker.
+        rows.append((is_disqualified, -score, cumtime, id))
+    rows.sort()
+    return _store(contest, contest.freeze_time, ContestScoreboardSnapshot.FREEZE,
+                  ((id, -score, cumtime, 0) for is_disqualified, score, cumtime, id in rows))
+
+
+@lru_cache(maxsize=64)
+def _load(snapshot_id):
+    # Snapshots never change once stored, so their arrays are kept by id.
+    snapshot = ContestScoreboardSnapshot.objects.only('time', 'kind', 'data').get(id=snapshot_id)
+    return Snapshot(snapshot.id, snapshot.time, snapshot.kind, *unpack(bytes(snapshot.data)))
+
+
+def get_snapshot(snapshot_id):
+    return _load(snapshot_id)
+
+
+def _first_id(queryset):
+    return queryset.values_list('id', flat=True).first()
+
+
+def _freeze_snapshot_id(contest):
+    return _first_id(contest.scoreboard_snapshots.filter(kind=ContestScoreboardSnapshot.FREEZE,
+                                                         time=contest.freeze_time).order_by('id'))
+
+
+def store_freeze_snapshot(contest):
+    """
+    Returns the id of the freeze snapshot of a contest, replaying and storing it if it was not stored yet, or
+    None if the format of the contest can not replay results. The contest is locked meanwhile, so that callers
+    arriving together wait for the first one's snapshot instead of each replaying and storing their own.
+    """
+    with transaction.atomic():
+        Contest.objects.select_for_update().values_list('id', flat=True).get(id=contest.id)
+        snapshot_id = _freeze_snapshot_id(contest)
+        if snapshot_id is None:
+            snapshot = take_freeze_snapshot(contest)
+            snapshot_id = snapshot and snapshot.id
+    return snapshot_id
+
+
+def get_freeze_snapshot(contest):
+    """
+    Returns the snapshot of the scoreboard of a contest at its freeze time, replaying it if it was not stored.
+    Contests whose format can not replay results fall back to the last snapshot taken before the freeze, or
+    to a scoreboard without results. Nothing taken after the freeze is ever returned.
+    """
+    snapshot_id = _freeze_snapshot_id(contest) or store_freeze_snapshot(contest)
+    if snapshot_id is None:
+        snapshot_id = _first_id(contest.scoreboard_snapshots.filter(time__lte=contest.freeze_time)
+                                .order_by('-time'))
+    if snapshot_id is None:
+        # Nothing to show yet: every participation tied without results.
+        ids = _array('L', contest.users.filter(virtual=0).order_by('id').values_list('id', flat=True))
+        return Snapshot(None, contest.freeze_time, ContestScoreboardSnapshot.FREEZE, ids, _array('L', [1] * len(ids)),
+                        _array('d', [0] * len(ids)), _array('L', [0] * len(ids)))
+    return get_snapshot(snapshot_id)
+
+
+def get_nearest_snapshot(contest, time, before=None):
+    """
+    Returns the snapshot of a contest taken nearest to a time, or None if it has none.
+    :param before: If given, only snapshots taken until this time are considered.
+    """
+    snapshots = contest.scoreboard_snapshots.all()
+    if before is not None:
+        snapshots = snapshots.filter(time__lte=before)
+    candidates = [snapshot for snapshot in (
+        snapshots.filter(time__lte=time).order_by('-time').values_list('id', 'time').first(),
+        snapshots.filter(time__gt=time).order_by('time').values_list('id', 'time').first(),
+    ) if snapshot is not None]
+    if not candidates:
+        return None
+    snapshot_id, _ = min(candidates, key=lambda snapshot: abs(snapshot[1] - time))
+    return get_snapshot(snapshot_id)
+
+
+def snapshot_standing(snapshot, participation_id, neighbours=2):
+    """
+    Returns the Standing of a participation on a snapshot, or None if it is not on it.
+    """
+    try:
+        position = snapshot.ids.index(participation_id)
+    except ValueError:
+        return None
+    rank = snapshot.ranks[position]
+    return Standing(
+        rank=rank,
+        tied=bisect_right(snapshot.ranks, rank) - bisect_left(snapshot.ranks, rank),
+        above=list(snapshot.ids[max(position - neighbours, 0):position]),
+        below=list(snapshot.ids[position + 1:position + 1 + neighbours]),
+    )
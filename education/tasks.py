@@ -0,0 +1,166 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from education import scoreboard
+from education.models.contest import Contest, ContestParticipation, ContestScoreboardSnapshot
+from education.models.submission import Submission
+from emath.celery import app
+
+logger = logging.getLogger('education.tasks')
+
+
+def judge_pending_submissions(submission_id):
+    """
+    Grades a submission together with every submission its participation queued before it, oldest first,
+    and folds each of them into the participation's results. The participation row stays locked while
+    grading, so submissions of one participation are never graded concurrently or out of order.
+    """
+    participation_id = Submission.objects.filter(id=submission_id).values_list('user_id', flat=True).first()
+    if participation_id is None:
+        return
+
+    with transaction.atomic():
+        participation = ContestParticipation.objects.select_for_update().filter(id=participation_id).first()
+        if participation is None:
+            return
+        pending = participation.submissions.filter(result='PE', time__isnull=False, id__lte=submission_id) \
+                                           .select_related('contest').order_by('date', 'id')
+        for submission in pending:
+            submission.user = participation
+            submission.judge()
+            submission.update_contest()
+
+
+@app.task(bind=True, max_retries=5, acks_late=True)
+def judge_submission(self, submission_id):
+    try:
+        judge_pending_submissions(submission_id)
+    except DatabaseError as e:
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+
+
+def enqueue_submission(submission):
+    """
+    Queues a submitted contest submission for grading. Falls back to grading it in-process when
+    asynchronous judging is disabled or the queue can not be reached.
+    """
+    if settings.EMATH_JUDGE_ASYNC:
+        try:
+            judge_submission.apply_async((submission.id,), retry=False)
+        except Exception:
+            logger.exception('Failed to queue submission %d, judging it in-process', submission.id)
+        else:
+            return
+    judge_pending_submissions(submission.id)
+
+
+@app.task
+def snapshot_scoreboard(contest_id, kind=ContestScoreboardSnapshot.PERIODIC):
+    from education.snapshots import store_freeze_snapshot, take_snapshot
+
+    contest = Contest.objects.filter(id=contest_id).first()
+    if contest is None:
+        return
+    if kind == ContestScoreboardSnapshot.FREEZE:
+        # The freeze time may have been moved since this task was queued.
+        if not contest.is_frozen:
+            return
+        # Replayed as of the freeze time, however late this runs, unless a ranking page already did. Formats
+        # that can not replay results keep their periodic snapshots, which are never shown as the frozen
+        # scoreboard.
+        if store_freeze_snapshot(contest) is not None:
+            return
+    take_snapshot(contest)
+
+
+def _has_freeze_snapshot(contest):
+    return contest.scoreboard_snapshots.filter(kind=ContestScoreboardSnapshot.FREEZE,
+                                               time=contest.freeze_time).exists()
+
+
+@app.task
+def snapshot_scoreboards():
+    """
+    Takes a snapshot of the scoreboard of every running contest, run periodically by celery beat. The run
+    after a contest ends captures its final scoreboard.
+    """
+    now = timezone.now()
+    interval = timedelta(seconds=settings.EMATH_SCOREBOARD_SNAPSHOT_INTERVAL)
+    for contest in Contest.objects.filter(start_time__lte=now, end_time__gt=now - interval):
+        kind = ContestScoreboardSnapshot.PERIODIC
+        if contest.is_frozen and not _has_freeze_snapshot(contest):
+            kind = ContestScoreboardSnapshot.FREEZE
+        snapshot_scoreboard(contest.id, kind)
+
+
+def schedule_freeze_snapshot(contest):
+    """
+    Queues the snapshot of a contest's scoreboard at its freeze time. snapshot_scoreboards takes it later
+    if the queue can not be reached, replayed as of the freeze time all the same.
+    """
+    if contest.freeze_time is None or contest.freeze_time <= timezone.now():
+        return
+    try:
+        snapshot_scoreboard.apply_async((contest.id, ContestScoreboardSnapshot.FREEZE), eta=contest.freeze_time,
+                                        retry=False)
+    except Exception:
+        logger.exception('Failed to schedule the freeze snapshot of contest %s', contest.key)
+
+
+@app.task
+def publish_scoreboards():
+    """
+    Writes the scoreboard of every running public contest as a static file, run periodically by celery beat.
+    The run after a contest ends writes its final scoreboard.
+    """
+    from education.scoreboard_files import is_public, write_scoreboard
+
+    if not settings.EMATH_SCOREBOARD_JSON_ROOT:
+        return
+    now = timezone.now()
+    interval = timedelta(seconds=settings.EMATH_SCOREBOARD_JSON_INTERVAL)
+    for contest in Contest.objects.filter(start_time__lte=now, end_time__gt=now - interval, is_visible=True,
+                                          is_private=False, is_organization_private=False):
+        if is_public(contest):
+            try:
+                write_scoreboard(contest)
+            except Exception:
+                logger.exception('Failed to write the scoreboard of contest %s', contest.key)
+
+
+@app.task
+def finalize_contest(contest_id):
+    contest = Contest.objects.filter(id=contest_id).first()
+    # The end time may have been moved since this task was queued.
+    if contest is None or not contest.ended:
+        return
+    scoreboard.finalize_ranks(contest)
+
+
+@app.task
+def finalize_contests():
+    """
+    Finalizes every ended contest that has unranked live participations, run periodically by celery beat in
+    case a scheduled finalization was lost.
+    """
+    contests = Contest.objects.filter(end_time__lte=timezone.now(), users__virtual=ContestParticipation.LIVE,
+                                      users__rank__isnull=True)
+    for contest_id in contests.values_list('id', flat=True).distinct():
+        finalize_contest(contest_id)
+
+
+def schedule_finalization(contest):
+    """
+    Queues the finalization of a contest's standings at its end time, or right away if it already ended.
+    An ended contest is finalized in-process when the queue can not be reached.
+    """
+    try:
+        finalize_contest.apply_async((contest.id,), eta=None if contest.ended else contest.end_time, retry=False)
+    except Exception:
+        logger.exception('Failed to schedule the finalization of contest %s', contest.key)
+        if contest.ended:
+            scoreboard.finalize_ranks(contest)
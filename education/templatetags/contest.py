@@ -4,6 +4,8 @@ from django.template.defaultfilters import date
 from django.utils.translation import gettext_lazy as _
 
 from backend.templatetags.variable import SetNewVariable
+from education import scoreboard
+from education.snapshots import get_freeze_snapshot, snapshot_standing
 
 register = template.Library()
 
@@ -30,4 +32,12 @@ def in_contest(contest, user):
 
 @register.simple_tag
 def label(contest, id):
-  return contest.get_label_for_problem(id)
\ No newline at end of file
+  return contest.get_label_for_problem(id)
+
+@register.simple_tag
+def contest_standing(contest, participation, user):
+  if participation is None or not participation.live or not contest.can_see_full_scoreboard(user):
+    return None
+  if not contest.can_see_unfrozen_scoreboard(user):
+    return snapshot_standing(get_freeze_snapshot(contest), participation.id, neighbours=0)
+  return scoreboard.get_standing(contest, participation, neighbours=0)
@@ -1,3 +1,943 @@
-from django.test import TestCase
+import io
+import random
+import zlib
+from collections import namedtuple
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, Permission
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from backend.models import Organization, Profile
+from education import grading, scoreboard, search, snapshots, tasks
+from education.models import (Answer, Contest, ContestParticipation, ContestProblem, Level, Problem, ProblemGroup,
+                              ProblemSearchDocument, Submission, SubmissionProblem)
+from education.models.contest import ContestScoreboardSnapshot
+from education.problem_list import get_level_listings, problem_list_key
+from education.scoreboard import RANKING_ORDER, Standing, neighbour_ranks, ranking_key
+from education.snapshots import get_freeze_snapshot, pack, store_freeze_snapshot, unpack
+from education.timeline import ContestTimeline
+from education.views.contest import ContestRanking, ContestTaskView, contest_page_ranker
+from education.visibility import get_contest_grants, get_problem_grants, listed_problems_q
+
+
+
+def create_contest(key='c', **kwargs):
+    now = timezone.now()
+    kwargs.setdefault('start_time', now - timedelta(hours=1))
+    kwargs.setdefault('end_time', now + timedelta(hours=1))
+    return Contest.objects.create(key=key, name=key.upper(), **kwargs)
+
+
+def create_problem(code, answer_type='mc', correct='b', **kwargs):
+    """
+    Creates a problem whose correct answer is correct. Multiple-choice problems get the options a, b and c.
+    """
+    level = Level.objects.get_or_create(code='l', defaults={'name': 'L', 'description': 'L'})[0]
+    problem = Problem.objects.create(code=code, name=code.upper(), description=code, level=level,
+                                     answer_type=answer_type, **kwargs)
+    for option in ('a', 'b', 'c') if answer_type == 'mc' else (correct,):
+        Answer.objects.create(problem=problem, description=option, is_correct=option == correct)
+    return problem
+
+
+def create_contest_problems(contest, *codes, points=10):
+    return [ContestProblem.objects.create(contest=contest, problem=create_problem(code), points=points, order=order)
+            for order, code in enumerate(codes)]
+
+
+def create_participation(contest, username, **kwargs):
+    user = Profile.objects.filter(username=username).first() or Profile.objects.create_user(username, username, 'x')
+    return ContestParticipation.objects.create(contest=contest, user=user, **kwargs)
+
+
+Row = namedtuple('Row', 'is_disqualified score cumtime tiebreaker id')
+
+
+def _order_key(row):
+    return tuple(-getattr(row, field[1:]) if field.startswith('-') else getattr(row, field)
+                 for field in RANKING_ORDER)
+
+
+class RankingKeyTestCase(SimpleTestCase):
+    def test_order_matches_ranking_order(self):
+        rows = [Row(is_disqualified, score, cumtime, tiebreaker, id)
+                for id, (is_disqualified, score, cumtime, tiebreaker) in enumerate(
+                    (is_disqualified, score, cumtime, tiebreaker)
+                    for is_disqualified in (0, 1)
+                    for score in (-9999, -1.5, 0, 0.25, 3, 100)
+                    for cumtime in (0, 5, 1234567)
+                    for tiebreaker in (-2.0, 0.0, 1.0))]
+        random.Random(0).shuffle(rows)
+        expected = sorted(rows, key=_order_key)
+        actual = sorted(rows, key=lambda row: (ranking_key(row.is_disqualified, row.score, row.cumtime,
+                                                           row.tiebreaker), row.id))
+        self.assertEqual(actual, expected)
+
+    def test_disqualified_rank_last(self):
+        self.assertLess(ranking_key(0, -9999, 10 ** 9, 1.0), ranking_key(1, 100, 0, 0.0))
+
+    def test_equal_results_tie(self):
+        self.assertEqual(ranking_key(0, 50, 30, 0), ranking_key(0, 50.0, 30.0, 0.0))
+
+
+Participation = namedtuple('Participation', 'id is_disqualified score cumtime tiebreaker')
+
+
+class NeighbourRanksTestCase(SimpleTestCase):
+    def test_ranks_from_positions(self):
+        scores = [100, 90, 90, 90, 80, 80, 80, 70, 70, 60]
+        participations = [Participation(id, False, score, 0, 0) for id, score in enumerate(scores)]
+        ranks = [1, 2, 2, 2, 5, 5, 5, 8, 8, 10]
+
+        def count_ahead(contest, participation):
+            return sum(score > participation.score for score in scores)
+
+        for position, participation in enumerate(participations):
+            above = [other.id for other in participations[max(position - 3, 0):position]]
+            below = [other.id for other in participations[position + 1:position + 4]]
+            standing = Standing(ranks[position], scores.count(participation.score), above, below)
+            with mock.patch('education.scoreboard.count_ahead', side_effect=count_ahead) as counted:
+                result = neighbour_ranks(None, participation, standing,
+                                         {other.id: other for other in participations})
+            self.assertEqual(result, {id: ranks[id] for id in above + below})
+            self.assertLessEqual(counted.call_count, 1)
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+class ScoreboardBuildTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        patcher = mock.patch('education.scoreboard.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.contest = create_contest()
+
+    def participate(self, username, score):
+        return create_participation(self.contest, username, score=score)
+
+    def test_rebuild_after_ready_expired(self):
+        # A board built without participations gets its keys from later updates, which outlive its ready key.
+        self.assertEqual(scoreboard.get_ranking(self.contest), [])
+        first = self.participate('first', 10)
+        scoreboard.update_participations(self.contest.id, [first])
+        board, members, ready, building = scoreboard._keys(self.contest.id)
+        self.redis.delete(ready)
+
+        ContestParticipation.objects.filter(id=first.id).update(score=90)
+        second = self.participate('second', 50)
+        self.assertEqual(scoreboard.get_ranking(self.contest), [first.id, second.id])
+
+    def test_updates_during_build_are_kept(self):
+        first, second = self.participate('first', 10), self.participate('second', 50)
+        live_participations = scoreboard._live_participations
+
+        def read_rows(contest):
+            # The participation changes after the build started, while its rows are being read.
+            rows = list(live_participations(contest))
+            first.score = 90
+            scoreboard.update_participations(contest.id, [first])
+            return ContestParticipation.objects.filter(id__in=[row.id for row in rows])
+
+        with mock.patch('education.scoreboard._live_participations', read_rows):
+            self.assertEqual(scoreboard.get_ranking(self.contest), [first.id, second.id])
+
+    @override_settings(EVENT_DAEMON_USE=False)
+    def test_deleted_participation_removed(self):
+        first, second = self.participate('first', 10), self.participate('second', 50)
+        self.assertEqual(scoreboard.get_ranking(self.contest), [second.id, first.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(scoreboard.get_ranking(self.contest), [first.id])
+
+
+class ContestTimelineTestCase(SimpleTestCase):
+    def setUp(self):
+        self.timeline = ContestTimeline({
+            1: [(10, 50, 10), (20, 100, 20)],
+            2: [(15, 100, 15)],
+            3: [],
+        })
+
+    def test_rank_during_contest(self):
+        self.assertEqual(self.timeline.rank_at(12, 50, 12), 2)
+        self.assertEqual(self.timeline.rank_at(12, 50, 10), 1)
+        self.assertEqual(self.timeline.rank_at(5, 50, 5), 1)
+
+    def test_rank_after_changes(self):
+        self.assertEqual(self.timeline.rank_at(30, 100, 18), 2)
+        self.assertEqual(self.timeline.rank_at(30, 100, 14), 1)
+
+    def test_idle_participations(self):
+        self.assertEqual(self.timeline.rank_at(30, 0, 0), 3)
+        self.assertEqual(self.timeline.rank_at(30, 0, 5), 4)
+        self.assertEqual(self.timeline.rank_at(30, -9999, 0), 4)
+
+
+def create_submission(participation, opened, submitted, points, max_points=10, result='WA'):
+    """
+    Creates a graded submission of a participation, opened and submitted the given numbers of minutes after
+    the start of its contest. A submitted of None leaves it open.
+    """
+    start = participation.contest.start_time
+    submission = Submission.objects.create(user=participation, contest=participation.contest, result=result,
+                                           points=points, max_points=max_points,
+                                           time=None if submitted is None else start + timedelta(minutes=submitted))
+    Submission.objects.filter(id=submission.id).update(date=start + timedelta(minutes=opened))
+    return submission
+
+
+class ResultsTimelineTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.contest = create_contest(start_time=now - timedelta(hours=3), end_time=now - timedelta(hours=1))
+        self.participation = create_participation(self.contest, 'user')
+
+    def timeline(self):
+        return self.contest.format.get_results_timeline(self.contest.users.all())[self.participation.id]
+
+    def test_results_change_when_submitted(self):
+        create_submission(self.participation, 10, 50, 5)
+        self.assertEqual(self.timeline(), [(3000, 50, 600)])
+
+    def test_steps_follow_submission_order(self):
+        # Opened first but submitted last, after a worse submission that was opened later.
+        create_submission(self.participation, 10, 90, 10)
+        create_submission(self.participation, 20, 30, 5)
+        self.assertEqual(self.timeline(), [(1800, 50, 1200), (5400, 100, 600)])
+
+    def test_open_attempts_are_skipped(self):
+        create_submission(self.participation, 10, None, 0, result='PE')
+        self.assertEqual(self.timeline(), [])
+
+
+class PackTestCase(SimpleTestCase):
+    def test_round_trip(self):
+        rows = [(7, 1, 100.0, 30), (3, 2, 87.5, 3600), (12, 2, 87.5, 3600), (4294967295, 4, -9999.0, 0)]
+        ids, ranks, scores, cumtimes = unpack(pack(rows))
+        self.assertEqual(list(zip(ids, ranks, scores, cumtimes)), rows)
+
+    def test_empty(self):
+        self.assertEqual(tuple(map(list, unpack(pack([])))), ([], [], [], []))
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            unpack(zlib.compress(b'XXXX\0\0\0\0'))
+
+
+class FreezeSnapshotTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Frozen for the last two hours, one hour after the start.
+        self.contest = create_contest(start_time=now - timedelta(hours=2), end_time=now + timedelta(hours=1),
+                                      frozen_last_minutes=120)
+        self.first = create_participation(self.contest, 'first')
+        self.second = create_participation(self.contest, 'second')
+        # Rolled back snapshots leave their ids to the next test.
+        snapshots._load.cache_clear()
+
+    def standings(self, snapshot):
+        return list(zip(snapshot.ids, snapshot.ranks, snapshot.scores, snapshot.cumtimes))
+
+    def test_answers_submitted_after_freeze(self):
+        create_submission(self.first, 10, 30, 5)
+        # Opened before the freeze, submitted after it.
+        create_submission(self.first, 50, 70, 10)
+        create_submission(self.second, 20, 40, 8)
+        self.assertEqual(self.standings(get_freeze_snapshot(self.contest)),
+                         [(self.second.id, 1, 80, 1200), (self.first.id, 2, 50, 600)])
+
+    def test_disqualified_rows(self):
+        create_submission(self.first, 10, 30, 10)
+        create_submission(self.second, 20, 40, 5)
+        ContestParticipation.objects.filter(id=self.first.id).update(is_disqualified=True)
+        self.assertEqual(self.standings(get_freeze_snapshot(self.contest)),
+                         [(self.second.id, 1, 50, 1200), (self.first.id, 2, -9999, 600)])
+
+    def test_stored_once(self):
+        snapshot = get_freeze_snapshot(self.contest)
+        self.assertEqual(get_freeze_snapshot(self.contest).id, snapshot.id)
+        self.assertEqual(store_freeze_snapshot(self.contest), snapshot.id)
+        self.assertEqual(self.contest.scoreboard_snapshots.count(), 1)
+
+    @mock.patch('education.contest_format.default.DefaultContestFormat.get_results_timeline',
+                side_effect=NotImplementedError)
+    def test_formats_without_replay(self, get_results_timeline):
+        snapshot = get_freeze_snapshot(self.contest)
+        self.assertIsNone(snapshot.id)
+        self.assertEqual(self.standings(snapshot), [(self.first.id, 1, 0, 0), (self.second.id, 1, 0, 0)])
+
+        before = ContestScoreboardSnapshot.objects.create(
+            contest=self.contest, time=self.contest.freeze_time - timedelta(minutes=5), size=0, data=pack([]))
+        ContestScoreboardSnapshot.objects.create(
+            contest=self.contest, time=self.contest.freeze_time + timedelta(minutes=5), size=0, data=pack([]))
+        self.assertEqual(get_freeze_snapshot(self.contest).id, before.id)
+
+
+@mock.patch('education.views.contest.enqueue_submission')
+class ContestTaskPostTestCase(TestCase):
+    def setUp(self):
+        self.contest = create_contest()
+        self.problems = create_contest_problems(self.contest, 'p1', 'p2')
+        self.participation = create_participation(self.contest, 'owner')
+        self.submission = Submission.objects.create(user=self.participation, contest=self.contest, result='PE')
+        self.other_problem, = create_contest_problems(create_contest('other'), 'p3')
+
+    def post(self, username, data):
+        request = RequestFactory().post('/', dict(data, submission=self.submission.id, contest='other'))
+        request.user = Profile.objects.filter(username=username).first() or \
+            Profile.objects.create_user(username, username, 'x')
+        return ContestTaskView.as_view()(request, contest=self.contest.key)
+
+    def answers(self):
+        return dict(SubmissionProblem.objects.filter(submission=self.submission).values_list('problem_id', 'output'))
+
+    def test_answers_own_submission(self, enqueue_submission):
+        response = self.post('owner', {'answer_%d' % self.problems[0].id: 'b',
+                                       'answer_%d' % self.other_problem.id: 'a'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.answers(), {self.problems[0].id: 'b'})
+        enqueue_submission.assert_called_once_with(self.submission)
+
+    def test_rejects_other_users(self, enqueue_submission):
+        with self.assertRaises(Http404):
+            self.post('intruder', {'answer_%d' % self.problems[0].id: 'b'})
+        self.assertEqual(self.answers(), {})
+        enqueue_submission.assert_not_called()
+
+    def test_rejects_duplicates(self, enqueue_submission):
+        self.post('owner', {'answer_%d' % self.problems[0].id: 'b'})
+        with mock.patch('education.views.contest.generic_message') as generic_message:
+            self.post('owner', {'answer_%d' % self.problems[1].id: 'a'})
+        generic_message.assert_called_once()
+        self.assertEqual(self.answers(), {self.problems[0].id: 'b'})
+        enqueue_submission.assert_called_once()
+
+
+@override_settings(EVENT_DAEMON_USE=True)
+class ContestRankingLiveUpdatesTestCase(TestCase):
+    def setUp(self):
+        self.contest = create_contest(is_visible=True)
+        create_participation(self.contest, 'user')
+
+    def context(self):
+        request = RequestFactory().get('/')
+        request.user = Profile.objects.get(username='user')
+        return ContestRanking.as_view()(request, contest=self.contest.key).context_data
+
+    @mock.patch('education.views.contest.event.last', return_value=0)
+    def test_before_daemon_replied(self, last):
+        context = self.context()
+        self.assertTrue(context['live_updates'])
+        self.assertEqual(context['last_msg'], 0)
+
+    @mock.patch('education.views.contest.event.last', return_value=0)
+    def test_daemon_disabled(self, last):
+        with self.settings(EVENT_DAEMON_USE=False):
+            self.assertNotIn('live_updates', self.context())
+
+
+@override_settings(EVENT_DAEMON_USE=False)
+class ContestAccessTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.contest = create_contest(is_visible=True, is_private=True)
+        self.user = Profile.objects.create_user('user', 'user', 'x')
+
+    def fresh(self):
+        return Contest.objects.get(id=self.contest.id), Profile.objects.get(id=self.user.id)
+
+    def test_cached_across_requests(self):
+        contest, user = self.fresh()
+        self.assertFalse(contest.is_accessible_by(user))
+        contest, user = self.fresh()
+        with self.assertNumQueries(0):
+            self.assertFalse(contest.is_accessible_by(user))
+
+    def test_private_contestants_change(self):
+        self.assertFalse(self.fresh()[0].is_accessible_by(self.user))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contest.private_contestants.add(self.user)
+        self.assertTrue(self.fresh()[0].is_accessible_by(self.user))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contest.private_contestants.clear()
+        self.assertFalse(self.fresh()[0].is_accessible_by(self.user))
+
+    def test_has_completed_contest(self):
+        Contest.objects.filter(id=self.contest.id).update(end_time=timezone.now() - timedelta(minutes=1))
+        contest, user = self.fresh()
+        self.assertFalse(contest.has_completed_contest(user))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_participation(self.contest, 'user')
+        contest, user = self.fresh()
+        self.assertTrue(contest.has_completed_contest(user))
+        contest, user = self.fresh()
+        with self.assertNumQueries(0):
+            self.assertTrue(contest.has_completed_contest(user))
+
+    def test_has_completed_running_contest(self):
+        create_participation(self.contest, 'user')
+        self.assertFalse(self.fresh()[0].has_completed_contest(self.user))
+
+
+User = namedtuple('User', 'participation key')
+
+
+class ContestPageRankerTestCase(SimpleTestCase):
+    def rank_page(self, keys, number, per_page):
+        users = [User(participation=index, key=key) for index, key in enumerate(keys)]
+        page = Paginator(users, per_page).page(number)
+
+        def count_ahead(contest, participation):
+            return sum(user.key < keys[participation] for user in users)
+
+        with mock.patch('education.views.contest.scoreboard.count_ahead', count_ahead):
+            ranked = contest_page_ranker(None, page)(page.object_list, key=lambda user: user.key)
+            return [rank for rank, user in ranked]
+
+    def test_ties_spanning_pages(self):
+        keys = [1, 2, 2, 2, 2, 3, 4]
+        self.assertEqual(self.rank_page(keys, 1, 3), [1, 2, 2])
+        self.assertEqual(self.rank_page(keys, 2, 3), [2, 2, 6])
+        self.assertEqual(self.rank_page(keys, 3, 3), [7])
+
+    def test_page_starting_a_tie(self):
+        self.assertEqual(self.rank_page([1, 2, 3, 3, 3], 2, 2), [3, 3])
+        self.assertEqual(self.rank_page([1, 2, 3, 3, 3], 3, 2), [3])
+
+    def test_empty_page(self):
+        self.assertEqual(self.rank_page([], 1, 3), [])
+
+
+@mock.patch('education.scoreboard.get_redis', return_value=None)
+class RankingIdsTestCase(TestCase):
+    def test_pages_in_ranking_order(self, get_redis):
+        contest = create_contest()
+        results = [(False, 50, 100), (False, 80, 300), (True, 90, 0), (False, 50, 20), (False, 80, 300)]
+        ids = [create_participation(contest, 'user%d' % index, is_disqualified=is_disqualified, score=score,
+                                    cumtime=cumtime).id
+               for index, (is_disqualified, score, cumtime) in enumerate(results)]
+        create_participation(contest, 'virtual', virtual=1, score=100)
+        ranking = scoreboard.RankingIds(contest)
+        self.assertEqual(ranking.count(), 5)
+        self.assertEqual(ranking[0:2] + ranking[2:4] + ranking[4:], [ids[1], ids[4], ids[3], ids[0], ids[2]])
+
+
+def create_answers(participation, outputs, **kwargs):
+    """
+    Creates a submitted, ungraded submission of a participation answering contest problems, given as a
+    dictionary mapping ContestProblem objects to outputs.
+    """
+    submission = Submission.objects.create(user=participation, contest=participation.contest, result='PE',
+                                           time=timezone.now(), **kwargs)
+    SubmissionProblem.objects.bulk_create(SubmissionProblem(submission=submission, problem=problem, output=output)
+                                          for problem, output in outputs.items())
+    return submission
+
+
+class GradingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.contest = create_contest()
+        self.mc, = create_contest_problems(self.contest, 'mc', points=10)
+        self.fill = ContestProblem.objects.create(contest=self.contest, points=30, order=1, problem=create_problem(
+            'fill', answer_type='fill', correct='x = 42'))
+        self.participation = create_participation(self.contest, 'user')
+
+    def test_judge(self):
+        submission = create_answers(self.participation, {self.mc: 'b', self.fill: '  x  =   42 '})
+        submission.judge()
+        submission.refresh_from_db()
+        self.assertEqual((submission.points, submission.max_points, submission.result), (40, 40, 'AC'))
+
+        submission = create_answers(self.participation, {self.mc: 'a', self.fill: 'x = 42'})
+        submission.judge()
+        submission.refresh_from_db()
+        self.assertEqual((submission.points, submission.max_points, submission.result), (30, 40, 'WA'))
+        self.assertEqual(dict(submission.problems.values_list('problem_id', 'result')),
+                         {self.mc.id: False, self.fill.id: True})
+        self.assertEqual(dict(submission.problems.values_list('problem_id', 'points')),
+                         {self.mc.id: 0, self.fill.id: 30})
+
+    def test_judge_queries_do_not_grow_with_answers(self):
+        submission = create_answers(self.participation, {self.mc: 'b'})
+        with self.assertNumQueries(5):
+            submission.judge()
+        problems = create_contest_problems(self.contest, *('p%d' % index for index in range(10)))
+        cache.clear()
+        submission = create_answers(self.participation, {problem: 'b' for problem in problems})
+        with self.assertNumQueries(5):
+            submission.judge()
+        self.assertEqual(submission.points, 100)
+
+    def test_single_problem(self):
+        problem = create_problem('task', answer_type='fill', correct='7')
+        submission = Submission.objects.create(profile=self.participation.user, problem=problem, is_contest=False)
+        row = SubmissionProblem.objects.create(submission=submission, task=problem, output=' 7')
+        submission.judge()
+        row.refresh_from_db()
+        self.assertEqual((submission.points, submission.result, row.result, row.points), (100, 'AC', True, 100))
+
+
+class AnswerEntriesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.mc = create_problem('mc')
+        self.fill = create_problem('fill', answer_type='fill', correct=' Paris  France ')
+
+    def test_entries(self):
+        entries = grading.get_answer_entries([self.mc.id, self.fill.id])
+        self.assertEqual(entries[self.mc.id], grading.AnswerEntry('b', None, ('a', 'b', 'c')))
+        self.assertEqual(entries[self.fill.id], grading.AnswerEntry(None, 'Paris France', (' Paris  France ',)))
+
+    def test_served_without_queries(self):
+        grading.get_answer_entries([self.mc.id])
+        with self.assertNumQueries(0):
+            grading.get_answer_entries([self.mc.id])
+        # Other processes find it in the shared cache.
+        grading._local_entries.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(grading.get_answer_entries([self.mc.id])[self.mc.id].correct, 'b')
+
+    def test_answer_changes(self):
+        grading.get_answer_entries([self.mc.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mc.answers.update(is_correct=False)
+            answer = self.mc.answers.get(description='c')
+            answer.is_correct = True
+            answer.save()
+        self.assertEqual(grading.get_answer_entries([self.mc.id])[self.mc.id].correct, 'c')
+        with self.captureOnCommitCallbacks(execute=True):
+            answer.delete()
+        self.assertEqual(grading.get_answer_entries([self.mc.id])[self.mc.id],
+                         grading.AnswerEntry(None, None, ('a', 'b')))
+
+    def test_problem_deleted(self):
+        problem_id = self.mc.id
+        grading.get_answer_entries([problem_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mc.delete()
+        self.assertEqual(grading.get_answer_entries([problem_id])[problem_id], grading.AnswerEntry(None, None, ()))
+
+
+class JudgeQueueTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.contest = create_contest()
+        self.problems = create_contest_problems(self.contest, 'p1', 'p2')
+        self.participation = create_participation(self.contest, 'user')
+
+    def results(self, *submissions):
+        return [Submission.objects.values_list('result', 'points').get(id=submission.id)
+                for submission in submissions]
+
+    @override_settings(EMATH_JUDGE_ASYNC=False)
+    def test_judged_in_process(self):
+        submission = create_answers(self.participation, {self.problems[0]: 'b', self.problems[1]: 'a'})
+        tasks.enqueue_submission(submission)
+        self.assertEqual(self.results(submission), [('WA', 10)])
+        self.participation.refresh_from_db()
+        self.assertEqual(self.participation.score, 50)
+
+    @override_settings(EMATH_JUDGE_ASYNC=True)
+    @mock.patch('education.tasks.judge_submission.apply_async')
+    def test_queued(self, apply_async):
+        submission = create_answers(self.participation, {self.problems[0]: 'b'})
+        tasks.enqueue_submission(submission)
+        apply_async.assert_called_once_with((submission.id,), retry=False)
+        self.assertEqual(self.results(submission), [('PE', 0)])
+
+    @override_settings(EMATH_JUDGE_ASYNC=True)
+    @mock.patch('education.tasks.judge_submission.apply_async', side_effect=ConnectionError)
+    def test_queue_unreachable(self, apply_async):
+        submission = create_answers(self.participation, {self.problems[0]: 'b'})
+        with self.assertLogs('education.tasks', 'ERROR'):
+            tasks.enqueue_submission(submission)
+        self.assertEqual(self.results(submission), [('WA', 10)])
+
+    def test_pending_judged_in_order(self):
+        first = create_answers(self.participation, {self.problems[0]: 'b', self.problems[1]: 'b'})
+        second = create_answers(self.participation, {self.problems[0]: 'b'})
+        opened = Submission.objects.create(user=self.participation, contest=self.contest, result='PE')
+        later = create_answers(self.participation, {self.problems[1]: 'b'})
+        tasks.judge_pending_submissions(second.id)
+        self.assertEqual(self.results(first, second, opened, later), [('AC', 20), ('WA', 10), ('PE', 0), ('PE', 0)])
+        self.participation.refresh_from_db()
+        self.assertEqual(self.participation.score, 100)
+
+
+class RegradeContestTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.contest = create_contest()
+        self.problems = create_contest_problems(self.contest, 'p1', 'p2')
+        self.participation = create_participation(self.contest, 'user')
+        self.submission = create_answers(self.participation, {self.problems[0]: 'b', self.problems[1]: 'c'})
+        self.participation.recompute_results()
+        # The second problem's answer key is corrected from b to c.
+        with self.captureOnCommitCallbacks(execute=True):
+            Answer.objects.filter(problem=self.problems[1].problem, description='b').update(is_correct=False)
+            Answer.objects.filter(problem=self.problems[1].problem, description='c').update(is_correct=True)
+            self.problems[1].problem.save()
+
+    def regrade(self, *args):
+        out = io.StringIO()
+        call_command('regrade_contest', self.contest.key, '--processes', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def state(self):
+        self.submission.refresh_from_db()
+        self.participation.refresh_from_db()
+        return self.submission.result, self.submission.points, self.participation.score
+
+    def test_dry_run(self):
+        output = self.regrade('--dry-run')
+        self.assertIn('submission %d: 10.0/20.0 WA -> 20.0/20.0 AC' % self.submission.id, output)
+        self.assertIn('1 answers and 1 submissions changed', output)
+        self.assertEqual(self.state(), ('WA', 10, 50))
+
+    def test_regrade(self):
+        self.regrade()
+        self.assertEqual(self.state(), ('AC', 20, 100))
+        self.assertEqual(list(self.submission.problems.order_by('problem__order').values_list('result', flat=True)),
+                         [True, True])
+        self.assertIn('0 answers and 0 submissions changed', self.regrade())
+
+    def test_unknown_contest(self):
+        with self.assertRaises(CommandError):
+            call_command('regrade_contest', 'missing')
+
+
+class IncrementalResultsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.contest = create_contest()
+        self.problems = create_contest_problems(self.contest, 'p1', 'p2')
+        self.participation = create_participation(self.contest, 'user')
+
+    def submit(self, minutes, *outputs):
+        submission = create_answers(self.participation, dict(zip(self.problems, outputs)))
+        Submission.objects.filter(id=submission.id).update(date=self.contest.start_time + timedelta(minutes=minutes))
+        submission.refresh_from_db()
+        submission.judge()
+        self.participation.update_results(submission)
+        return self.results()
+
+    def results(self):
+        participation = ContestParticipation.objects.get(id=self.participation.id)
+        return participation.score, participation.cumtime, participation.format_data
+
+    def test_best_submission_kept(self):
+        p1, p2 = (str(problem.id) for problem in self.problems)
+        self.assertEqual(self.submit(10, 'a', 'a'), (0, 600, {p1: {'status': False}, p2: {'status': False}}))
+        self.assertEqual(self.submit(20, 'b', 'a'), (50, 1200, {p1: {'status': True}, p2: {'status': False}}))
+        # Equal and worse submissions leave the earlier best one in place.
+        self.assertEqual(self.submit(30, 'a', 'b'), (50, 1200, {p1: {'status': True}, p2: {'status': False}}))
+        self.assertEqual(self.submit(40, 'a', 'a'), (50, 1200, {p1: {'status': True}, p2: {'status': False}}))
+        self.assertEqual(self.submit(50, 'b', 'b'), (100, 3000, {p1: {'status': True}, p2: {'status': True}}))
+
+    def test_first_submission_without_answers(self):
+        self.assertEqual(self.submit(10), (0, 600, {}))
+        self.assertEqual(self.submit(20, 'a', 'a')[:2], (0, 600))
+
+    def test_matches_full_recompute(self):
+        for minutes, outputs in ((10, 'ab'), (20, 'ba'), (30, 'bb'), (40, 'ba')):
+            incremental = self.submit(minutes, *outputs)
+        self.participation.recompute_results()
+        self.assertEqual(self.results(), incremental)
+
+    def test_queries_do_not_scan_submissions(self):
+        for minutes in range(5):
+            self.submit(minutes, 'a', 'a')
+        submission = create_answers(self.participation, {self.problems[0]: 'b'})
+        submission.judge()
+        with self.assertNumQueries(2):
+            self.participation.contest.format.handle_submission(self.participation, submission)
+
+
+class BatchResultsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.contest = create_contest()
+        self.problems = create_contest_problems(self.contest, 'p1', 'p2')
+
+    def participate(self, username, *submissions):
+        participation = create_participation(self.contest, username)
+        for minutes, outputs in submissions:
+            submission = create_answers(participation, dict(zip(self.problems, outputs)))
+            Submission.objects.filter(id=submission.id).update(
+                date=self.contest.start_time + timedelta(minutes=minutes))
+        return participation
+
+    def results(self):
+        return {participation.id: (participation.score, participation.cumtime, participation.format_data)
+                for participation in self.contest.users.all()}
+
+    def test_matches_update_participation(self):
+        self.participate('first', (10, 'ab'), (20, 'bb'))
+        self.participate('second', (5, 'ba'), (15, 'ab'))
+        self.participate('idle')
+        self.participate('open')
+        Submission.objects.create(user=self.contest.users.get(user__username='open'), contest=self.contest,
+                                  result='PE')
+        self.contest.format.update_participations(self.contest.users.all())
+        batch = self.results()
+        for participation in self.contest.users.all():
+            self.contest.format.update_participation(participation)
+        self.assertEqual(self.results(), batch)
+        self.assertEqual(sorted(score for score, cumtime, format_data in batch.values()), [0, 0, 50, 100])
+
+    def test_disqualified(self):
+        participation = self.participate('user', (10, 'bb'))
+        ContestParticipation.objects.filter(id=participation.id).update(is_disqualified=True)
+        self.contest.recompute_results()
+        participation.refresh_from_db()
+        self.assertEqual(participation.score, -9999)
+
+    def test_queries_do_not_grow_with_participations(self):
+        def count(users):
+            for index in range(users):
+                self.participate('user%d_%d' % (users, index), (10, 'ab'), (20, 'bb'))
+            Submission.objects.update(max_points=0)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.contest.format.update_participations(self.contest.users.all())
+            self.contest.users.all().delete()
+            return len(queries)
+
+        self.assertEqual(count(2), count(6))
+
+
+class EditorIdsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.contest = create_contest()
+        self.problem = create_problem('p')
+        self.author, self.curator = (Profile.objects.create_user(name, name, 'x') for name in ('author', 'curator'))
+
+    def test_contest_editors(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contest.authors.add(self.author)
+            self.contest.curators.add(self.curator)
+        contest = Contest.objects.get(id=self.contest.id)
+        self.assertEqual(contest.author_ids, {self.author.id})
+        self.assertEqual(contest.editor_ids, {self.author.id, self.curator.id})
+        contest = Contest.objects.get(id=self.contest.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(contest.editor_ids, {self.author.id, self.curator.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contest.curators.remove(self.curator)
+        self.assertEqual(Contest.objects.get(id=self.contest.id).editor_ids, {self.author.id})
+
+    def test_problem_authors(self):
+        self.assertEqual(Problem.objects.get(id=self.problem.id).author_ids, set())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.authors.add(self.author)
+        problem = Problem.objects.get(id=self.problem.id)
+        self.assertEqual(problem.author_ids, {self.author.id})
+        problem = Problem.objects.get(id=self.problem.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(problem.author_ids, {self.author.id})
+
+
+class ContestVisibilityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.organization = Organization.objects.create(name='O', slug='o', short_name='O', about='O')
+        self.public = create_contest('public', is_visible=True)
+        self.private = create_contest('private', is_visible=True, is_private=True)
+        self.organization_private = create_contest('organization', is_visible=True, is_organization_private=True)
+        self.organization_private.organizations.add(self.organization)
+        create_contest('hidden', is_visible=False, is_private=True).private_contestants.add(
+            Profile.objects.create_user('other', 'other', 'x'))
+        self.user = Profile.objects.create_user('user', 'user', 'x')
+
+    def visible(self, user):
+        return set(Contest.get_visible_contests(Profile.objects.get(id=user.id)).values_list('key', flat=True))
+
+    def test_public_contests(self):
+        self.assertEqual(set(Contest.get_visible_contests(AnonymousUser()).values_list('key', flat=True)),
+                         {'public'})
+        self.assertEqual(self.visible(self.user), {'public'})
+
+    def test_grants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private.private_contestants.add(self.user)
+        self.assertEqual(self.visible(self.user), {'public', 'private'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.organizations.add(self.organization)
+        self.assertEqual(self.visible(self.user), {'public', 'private', 'organization'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private.private_contestants.remove(self.user)
+            self.private.curators.add(self.user)
+        self.assertEqual(self.visible(self.user), {'public', 'private', 'organization'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.organization_private.is_visible = False
+            self.organization_private.save()
+        self.assertEqual(self.visible(self.user), {'public', 'private'})
+
+    def test_grants_cached(self):
+        self.user.organizations.add(self.organization)
+        self.private.view_contest_scoreboard.add(self.user)
+        user = Profile.objects.get(id=self.user.id)
+        self.assertEqual(get_contest_grants(user), {self.private.id, self.organization_private.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_contest_grants(user), {self.private.id, self.organization_private.id})
+
+
+class ProblemVisibilityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.organization, other = (Organization.objects.create(name=name, slug=name, short_name=name, about=name)
+                                    for name in ('o', 'other'))
+        create_problem('public', is_public=True)
+        create_problem('private')
+        for code, organization in (('organization', self.organization), ('other', other)):
+            create_problem(code, is_public=True, is_organization_private=True).organizations.add(organization)
+        self.user = Profile.objects.create_user('user', 'user', 'x')
+
+    def listed(self, user):
+        return set(Problem.objects.filter(listed_problems_q(user)).values_list('code', flat=True))
+
+    def test_public_problems(self):
+        self.assertEqual(self.listed(AnonymousUser()), {'public'})
+        self.assertEqual(self.listed(self.user), {'public'})
+        self.assertFalse(Problem.objects.get(code='organization').is_accessible_by(self.user))
+
+    def test_organization_problems(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.organizations.add(self.organization)
+        user = Profile.objects.get(id=self.user.id)
+        self.assertEqual(self.listed(user), {'public', 'organization'})
+        self.assertTrue(Problem.objects.get(code='organization').is_accessible_by(user))
+        self.assertFalse(Problem.objects.get(code='other').is_accessible_by(user))
+        self.assertEqual(set(Problem.get_visible_problems(user).values_list('code', flat=True)),
+                         {'public', 'organization'})
+
+    def test_authored_problems(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for code in ('private', 'other'):
+                Problem.objects.get(code=code).authors.add(self.user)
+        # An author is not listed the problems private to organizations they are not in.
+        self.assertEqual(self.listed(self.user), {'public', 'private'})
+        self.assertEqual(set(Problem.get_visible_problems(self.user).values_list('code', flat=True)),
+                         {'public', 'private', 'other'})
+
+    def test_permission_lists_all_public_problems(self):
+        self.user.user_permissions.add(Permission.objects.get(codename='see_organization_problem'))
+        self.assertEqual(self.listed(Profile.objects.get(id=self.user.id)), {'public', 'organization', 'other'})
+
+    def test_grants_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.organizations.add(self.organization)
+        user = Profile.objects.get(id=self.user.id)
+        grants = get_problem_grants(user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_problem_grants(user), grants)
+        with self.captureOnCommitCallbacks(execute=True):
+            Problem.objects.get(code='organization').organizations.clear()
+        self.assertEqual(self.listed(user), {'public'})
+
+
+class LevelListingsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.levels = [Level.objects.create(code=code, name=code, description=code) for code in ('l1', 'l2', 'l3')]
+        for level, count in zip(self.levels, (5, 2, 0)):
+            for index in reversed(range(count)):
+                code = '%s-%d' % (level.code, index)
+                Problem.objects.create(code=code, name=code, description=code, level=level, is_public=True)
+        Problem.objects.create(code='l2-private', name='P', description='P', level=self.levels[1])
+
+    def test_listings(self):
+        with self.assertNumQueries(3):
+            listings = get_level_listings(Problem.objects.filter(listed_problems_q(AnonymousUser())), 3)
+            self.assertEqual([listing.level for listing in listings], self.levels)
+            self.assertEqual([[problem.code for problem in listing.problems] for listing in listings],
+                             [['l1-0', 'l1-1'], ['l2-0', 'l2-1'], []])
+            self.assertEqual([(listing.count, listing.has_more) for listing in listings],
+                             [(5, True), (2, False), (0, False)])
+
+    def test_key(self):
+        user, other = (Profile.objects.create_user(name, name, 'x') for name in ('user', 'other'))
+        key = problem_list_key(user)
+        self.assertEqual(problem_list_key(other), key)
+        self.assertEqual(problem_list_key(AnonymousUser()), key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Problem.objects.get(code='l2-private').authors.add(user)
+        self.assertNotEqual(problem_list_key(user), problem_list_key(other))
+
+        key = problem_list_key(other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.levels[2].save()
+        self.assertNotEqual(problem_list_key(other), key)
+
+
+class ProblemSearchTestCase(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group = ProblemGroup.objects.create(name='Geometry', short_name='geo')
+            level = Level.objects.create(code='l', name='L', description='L')
+            for code, name, description, is_public in (('tri', 'Triangles', 'Angles of a triangle', True),
+                                                       ('sum', 'Sums', 'Sums of many triangles', True),
+                                                       ('hid', 'Hidden triangles', 'Triangles', False)):
+                Problem.objects.create(code=code, name=name, description=description, level=level,
+                                       is_public=is_public)
+
+    def search(self, term, queryset=None):
+        if queryset is None:
+            queryset = Problem.objects.filter(is_public=True)
+        return [problem.code for problem in search.search_problems(queryset, term)]
+
+    def test_best_matches_first(self):
+        self.assertEqual(self.search('triang'), ['tri', 'sum'])
+        self.assertEqual(self.search('TRIANGLES sum'), ['sum'])
+        self.assertEqual(self.search('squares'), [])
+        self.assertEqual(self.search(' - '), ['sum', 'tri'])
+
+    def test_invisible_problems_do_not_take_results(self):
+        with mock.patch.object(search, 'MAX_RESULTS', 1):
+            self.assertEqual(self.search('triangles'), ['tri'])
+        self.assertEqual(self.search('hidden', Problem.objects.all()), ['hid'])
+
+    def test_reindexed_on_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            problem = Problem.objects.get(code='sum')
+            problem.name = 'Squares'
+            problem.save()
+        self.assertEqual(self.search('squares'), ['sum'])
+        self.assertEqual(self.search('geo'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            problem.category.add(self.group)
+        self.assertEqual(self.search('geometry'), ['sum'])
+        with self.captureOnCommitCallbacks(execute=True):
+            problem.delete()
+        self.assertEqual(self.search('squares'), [])
+
+    def test_index_problems_command(self):
+        ProblemSearchDocument.objects.all().delete()
+        self.assertEqual(self.search('triang'), [])
+        call_command('index_problems', chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(self.search('triang'), ['tri', 'sum'])
+
+
+class MemorySearchTestCase(ProblemSearchTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(search, '_backend', search.MemorySearch())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
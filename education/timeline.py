@@ -0,0 +1,77 @@
+"""
+The results timeline of the live participations of an ended contest, used to rank a virtual participation
+against the standings the live participants had at the same elapsed time.
+
+Every live participation is stored as three parallel arrays of elapsed seconds, scores and cumtimes, one entry
+for every change of its results. The timeline is built once per contest and cached until a participation of
+the contest changes.
+"""
+from array import array
+from bisect import bisect_right
+
+from django.core.cache import cache
+
+from backend.utils.versions import bump_versions, get_version
+
+__all__ = ['ContestTimeline', 'get_timeline', 'invalidate_timeline']
+
+TIMELINE_CACHE_TIMEOUT = 86400
+
+
+class ContestTimeline(object):
+    def __init__(self, steps):
+        """
+        :param steps: A dictionary mapping participation ids to lists of (elapsed, score, cumtime) tuples,
+                      as returned by BaseContestFormat.get_results_timeline.
+        """
+        self.idle = 0
+        self.steps = []
+        for changes in steps.values():
+            if not changes:
+                # Never submitted: stays at a zero score and cumtime for the whole contest.
+                self.idle += 1
+                continue
+            self.steps.append(tuple(array('d', column) for column in zip(*changes)))
+
+    def rank_at(self, elapsed, score, cumtime):
+        """
+        Returns the rank a participation with the given results would have had among the live participations
+        after the given number of seconds of the contest.
+        """
+        better = self.idle if score < 0 or (score == 0 and cumtime > 0) else 0
+        for times, scores, cumtimes in self.steps:
+            index = bisect_right(times, elapsed) - 1
+            if index < 0:
+                other_score, other_cumtime = 0, 0
+            else:
+                other_score, other_cumtime = scores[index], cumtimes[index]
+            if other_score > score or (other_score == score and other_cumtime < cumtime):
+                better += 1
+        return better + 1
+
+
+def _version_key(contest_id):
+    return 'contest_timeline_version:%d' % contest_id
+
+
+def get_timeline(contest):
+    """
+    Returns the ContestTimeline of an ended contest, or None if the contest has not ended or its format can
+    not replay its results.
+    """
+    if not contest.ended:
+        return None
+    key = 'contest_timeline:%d:%s' % (contest.id, get_version(_version_key(contest.id)))
+    timeline = cache.get(key)
+    if timeline is None:
+        try:
+            steps = contest.format.get_results_timeline(contest.users.filter(virtual=0, is_disqualified=False))
+        except NotImplementedError:
+            return None
+        timeline = ContestTimeline(steps)
+        cache.set(key, timeline, TIMELINE_CACHE_TIMEOUT)
+    return timeline
+
+
+def invalidate_timeline(contest_id):
+    bump_versions([_version_key(contest_id)])
@@ -27,6 +27,7 @@ urlpatterns += [
     path('contest/<slug:contest>/', include([
         path('', contest.ContestDetail.as_view(), name="contest_detail"),
         path('ranking/', contest.ContestRanking.as_view(), name='contest_ranking'),
+        path('ranking/me/', contest.ContestRankingMe.as_view(), name='contest_ranking_me'),
         path('join/', contest.ContestJoin.as_view(), name='contest_join'),
         path('leave/', contest.ContestLeave.as_view(), name='contest_leave'),
         path('task/', contest.ContestTaskView.as_view(), name='contest_task'),
@@ -1,4 +1,5 @@
 from collections import namedtuple
+from datetime import datetime
 from functools import partial
 from itertools import chain
 from operator import attrgetter
@@ -9,7 +10,7 @@ import shutil
 from django import forms
 from django.conf import settings
 from django.db import IntegrityError
-from django.http import Http404, HttpResponseRedirect, HttpResponse
+from django.http import Http404, HttpResponseRedirect, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.views import View
@@ -18,18 +19,26 @@ from django.views.generic.detail import BaseDetailView, SingleObjectMixin
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.safestring import mark_safe
 from django.utils.functional import cached_property
 from django.db.models import Q, F, Max
 from django.template.loader import get_template
+from backend.utils.diggpaginator import DiggPaginator, InvalidPage
 from backend.utils.ranker import ranker
 
 from backend.utils.views import generic_message, QueryStringSortMixin, TitleMixin, DiggPaginatorMixin, add_file_response
 from backend.pdf import HAS_PDF, DefaultPdfMaker
 from education.models import Contest
 from education.models.contest import ContestParticipation, ContestProblem, ContestSolution
-from education.models.problem import Answer
-from education.models.submission import Submission, SubmissionProblem
+from education import scoreboard
+from emath import event
+from education.grading import get_answer_entries, ingest_answers
+from education.scoreboard_files import scoreboard_url
+from education.snapshots import get_freeze_snapshot, get_nearest_snapshot, snapshot_standing
+from education.timeline import get_timeline
+from education.models.submission import Submission
+from education.tasks import enqueue_submission
 
 class PrivateContestError(Exception):
     def __init__(self, name, is_private, is_organization_private, orgs):
@@ -326,13 +335,20 @@ BestSolutionData = namedtuple(
   'BestSolutionData', 'code points time state is_pretested'
 )
 
-def make_contest_ranking_profile(contest, participation, contest_problems):
+def render_contest_ranking_cells(contest, participation, contest_problems):
   def display_user_problem(contest_problem):
     try:
       return contest.format.display_user_problem(participation, contest_problem)
     except (KeyError, TypeError, ValueError):
       return mark_safe('<td>???</td>')
 
+  return (contest.format.display_participation_result(participation),
+          [display_user_problem(problem) for problem in contest_problems])
+
+def make_contest_ranking_profile(contest, participation, contest_problems, cells=None):
+  if cells is None:
+    cells = render_contest_ranking_cells(contest, participation, contest_problems)
+  result_cell, problem_cells = cells
   user = participation.user
 
   return ContestRankingProfile(
@@ -345,19 +361,67 @@ def make_contest_ranking_profile(contest, participation, contest_problems):
     tiebreaker=participation.tiebreaker,
     organization=user.organization,
     participation_rating=participation.rating.rating if hasattr(participation, 'rating') else None,
-    problem_cells=[display_user_problem(problem) for problem in contest_problems],
-    result_cell=contest.format.display_participation_result(participation),
+    problem_cells=problem_cells,
+    result_cell=result_cell,
     participation=participation
   )
 
 def base_contest_ranking_list(contest, problems, queryset):
-  return [make_contest_ranking_profile(contest, participation, problems) for participation in 
-          queryset.select_related('user').defer('user__about', 'user__organizations__about')]
+  participations = list(queryset.select_related('user').defer('user__about', 'user__organizations__about'))
+  # The cells of a row only change when its participation is saved, so they are rendered once and cached.
+  cells = scoreboard.get_row_cells(contest, participations,
+                                   partial(render_contest_ranking_cells, contest, contest_problems=problems))
+  return [make_contest_ranking_profile(contest, participation, problems, (result_cell, [problem_cells]))
+          for participation, (result_cell, problem_cells) in zip(participations, cells)]
 
 def contest_ranking_list(contest, problems):
-  return base_contest_ranking_list(contest, problems, contest.users.filter(virtual=0)
-                                  .prefetch_related('user__organizations')
-                                  .order_by('is_disqualified', '-score', 'cumtime', 'tiebreaker'))
+  queryset = contest.users.filter(virtual=0).prefetch_related('user__organizations')
+  ranking = scoreboard.get_ranking(contest)
+  if ranking is None:
+    return base_contest_ranking_list(contest, problems,
+                                     queryset.order_by(*scoreboard.RANKING_ORDER))
+
+  order = {participation_id: index for index, participation_id in enumerate(ranking)}
+  users = base_contest_ranking_list(contest, problems, queryset.filter(id__in=ranking))
+  users.sort(key=lambda user: order[user.participation.id])
+  return users
+
+def contest_ranking_page(contest, problems, page):
+  order = {participation_id: index for index, participation_id in enumerate(page.object_list)}
+  users = base_contest_ranking_list(contest, problems, contest.users.filter(id__in=page.object_list)
+                                                                    .prefetch_related('user__organizations'))
+  users.sort(key=lambda user: order[user.participation.id])
+  return users
+
+def contest_page_ranker(contest, page):
+  # Rows are ranked by position from the page's offset, except that the rows tied with the first row of the
+  # page may be tied with rows of the previous pages, so their rank is counted from the database.
+  def page_ranker(users, key):
+    users = list(users)
+    if not users:
+      return
+    first_key = key(users[0])
+    first_rank = scoreboard.count_ahead(contest, users[0].participation) + 1
+    for rank, user in ranker(users, key=key, rank=page.start_index() - 1):
+      yield (first_rank if key(user) == first_key else rank), user
+  return page_ranker
+
+def snapshot_ranking_page(contest, problems, page, snapshot):
+  # Snapshots only keep the results of every participation, so problem cells are left blank.
+  problem_cells = [mark_safe('<td class="problem_cell"></td>' * len(problems))]
+  positions = range(page.start_index() - 1, page.end_index())
+  participations = contest.users.select_related('user').prefetch_related('user__organizations') \
+                          .defer('user__about', 'user__organizations__about').in_bulk(page.object_list)
+  users = []
+  for position in positions:
+    participation = participations.get(snapshot.ids[position])
+    if participation is None:
+      continue
+    participation.score = snapshot.scores[position]
+    participation.cumtime = snapshot.cumtimes[position]
+    cells = (contest.format.display_participation_result(participation), problem_cells)
+    users.append((snapshot.ranks[position], make_contest_ranking_profile(contest, participation, problems, cells)))
+  return users
 
 class ContestRankingBase(ContestMixin, TitleMixin, DetailView):
     template_name = 'contest/ranking.html'
@@ -381,10 +445,17 @@ class ContestRankingBase(ContestMixin, TitleMixin, DetailView):
         users, problems = self.get_ranking_list()
         context['users'] = users
         context['problems'] = problems
-        # context['last_msg'] = event.last()
         # context['tab'] = self.tab
         return context
 
+def virtual_rank(contest, participation):
+    # Where the virtual participation would stand among the live participants at the same elapsed time.
+    timeline = get_timeline(contest) if participation.virtual > 0 else None
+    if timeline is None:
+        return '-'
+    elapsed = min(participation._now, participation.end_time) - participation.start
+    return timeline.rank_at(elapsed.total_seconds(), participation.score, participation.cumtime)
+
 def get_contest_ranking_list(request, contest, participation=None, ranking_list=contest_ranking_list,
                           show_current_virtual=True, ranker=ranker):
     problems = list(contest.contest_problems.select_related('problem').defer('problem__description').order_by('order'))
@@ -397,13 +468,18 @@ def get_contest_ranking_list(request, contest, participation=None, ranking_list=
             if participation is None or participation.contest_id != contest.id:
                 participation = None
         if participation is not None and participation.virtual:
-            users = chain([('-', make_contest_ranking_profile(contest, participation, problems))], users)
+            users = chain([(virtual_rank(contest, participation),
+                            make_contest_ranking_profile(contest, participation, problems))], users)
     
     return users, problems
 
 
 class ContestRanking(ContestRankingBase):
   tab = 'ranking'
+  paginate_by = 100
+  page_obj = None
+  snapshot = None
+  scoreboard_url = None
 
   def get_title(self):
     return _('%s Rankings') % self.object.name
@@ -417,18 +493,162 @@ class ContestRanking(ContestRankingBase):
         ranker=lambda users, key: ((_('???'), user) for user in users),
       )
 
-    return get_contest_ranking_list(self.request, self.object)
+    if not self.request.user.is_authenticated and 'at' not in self.request.GET:
+      # Spectators of a running public contest get the rows from its published scoreboard.
+      self.scoreboard_url = scoreboard_url(self.object)
+      if self.scoreboard_url is not None:
+        return get_contest_ranking_list(self.request, self.object, ranking_list=lambda contest, problems: [])
+
+    self.snapshot = self.get_snapshot()
+    if self.snapshot is not None:
+      self.page_obj = self.paginate(self.snapshot.ids)
+      return get_contest_ranking_list(
+        self.request, self.object,
+        ranking_list=partial(snapshot_ranking_page, page=self.page_obj, snapshot=self.snapshot),
+        ranker=lambda users, key: users,
+      )
+
+    if scoreboard.has_final_ranks(self.object):
+      self.page_obj = self.paginate(scoreboard.final_ranking(self.object).prefetch_related('user__organizations'))
+      return get_contest_ranking_list(
+        self.request, self.object,
+        ranking_list=partial(base_contest_ranking_list, queryset=self.page_obj.object_list),
+        ranker=lambda users, key: ((user.participation.rank, user) for user in users),
+      )
+
+    self.page_obj = self.paginate(scoreboard.RankingIds(self.object))
+    return get_contest_ranking_list(
+      self.request, self.object,
+      ranking_list=partial(contest_ranking_page, page=self.page_obj),
+      ranker=contest_page_ranker(self.object, self.page_obj),
+    )
+
+  def paginate(self, ranking):
+    paginator = DiggPaginator(ranking, self.paginate_by, body=6, padding=2)
+    try:
+      return paginator.page(self.request.GET.get('page', 1))
+    except InvalidPage:
+      raise Http404()
+
+  def get_snapshot(self):
+    contest = self.object
+    frozen = not contest.can_see_unfrozen_scoreboard(self.request.user)
+    at = self.request.GET.get('at')
+    if at:
+      try:
+        time = parse_datetime(at)
+      except ValueError:
+        raise Http404()
+      if time is None:
+        try:
+          time = datetime.fromtimestamp(int(at), timezone.utc)
+        except (ValueError, OverflowError, OSError):
+          raise Http404()
+      elif timezone.is_naive(time):
+        time = timezone.make_aware(time)
+      snapshot = get_nearest_snapshot(contest, time, before=contest.freeze_time if frozen else None)
+      if snapshot is None:
+        raise Http404()
+      return snapshot
+    if frozen:
+      return get_freeze_snapshot(contest)
+    return None
 
   def get_context_data(self, **kwargs):
     context = super().get_context_data(**kwargs)
     # context['has_rating'] = self.object.ratings.exists()
+    if self.scoreboard_url is not None:
+      context['scoreboard_url'] = self.scoreboard_url
+      context['scoreboard_interval'] = settings.EMATH_SCOREBOARD_JSON_INTERVAL
+    if self.page_obj is not None:
+      query = self.request.GET.copy()
+      query.setlist('page', [])
+      context['page_obj'] = self.page_obj
+      context['page_prefix'] = '?%s&page=' % query.urlencode() if query else '?page='
+      context['first_page_href'] = '%s?%s' % (self.request.path, query.urlencode()) if query else self.request.path
+      context['snapshot'] = self.snapshot
+      context['snapshot_frozen'] = self.snapshot is not None and 'at' not in self.request.GET
+      if self.snapshot is None and settings.EVENT_DAEMON_USE:
+        # The last message id stays 0 until this process heard back from the daemon, and pages rendered
+        # meanwhile still follow the contest, from the messages the daemon kept.
+        context['live_updates'] = True
+        context['last_msg'] = event.last()
+        context['EVENT_DAEMON_LOCATION'] = settings.EVENT_DAEMON_GET
+        context['EVENT_DAEMON_POLL_LOCATION'] = settings.EVENT_DAEMON_POLL
     return context
 
 
-def get_answer_contest_problem(problem):
-  ans = list(Answer.objects.filter(problem=problem))
+class ContestRankingMe(ContestMixin, SingleObjectMixin, View):
+  neighbours = 2
+
+  def get(self, request, *args, **kwargs):
+    if not request.user.is_authenticated:
+      raise Http404()
+    try:
+      self.object = self.get_object()
+    except Http404:
+      return self.no_such_contest()
+    contest = self.object
+    if not contest.can_see_own_scoreboard(request.user):
+      raise Http404()
+    participation = get_object_or_404(contest.users, user=request.user, virtual=ContestParticipation.LIVE)
+
+    data = {
+      'participation': participation.id,
+      'score': participation.score,
+      'cumtime': participation.cumtime,
+      'rank': None,
+      'tied': None,
+      'above': [],
+      'below': [],
+    }
+    if not contest.can_see_full_scoreboard(request.user):
+      return JsonResponse(data)
+
+    if contest.can_see_unfrozen_scoreboard(request.user):
+      standing = scoreboard.get_standing(contest, participation, self.neighbours)
+      results = None
+    else:
+      # Neighbours are shown with their results at the freeze.
+      snapshot = get_freeze_snapshot(contest)
+      standing = snapshot_standing(snapshot, participation.id, self.neighbours)
+      if standing is None:
+        return JsonResponse(data)
+      results = {id: (snapshot.scores[index], snapshot.cumtimes[index], snapshot.ranks[index])
+                 for index, id in enumerate(snapshot.ids) if id in standing.above or id in standing.below}
+    neighbours = contest.users.select_related('user').in_bulk(standing.above + standing.below)
+    if results is None:
+      ranks = scoreboard.neighbour_ranks(contest, participation, standing, neighbours)
+
+    def neighbour(participation_id):
+      other = neighbours[participation_id]
+      if results is None:
+        score, cumtime, rank = other.score, other.cumtime, ranks[participation_id]
+      else:
+        score, cumtime, rank = results[participation_id]
+      return {
+        'participation': other.id,
+        'username': other.user.username,
+        'score': score,
+        'cumtime': cumtime,
+        'rank': rank,
+      }
+
+    data.update(
+      rank=standing.rank,
+      tied=standing.tied,
+      above=[neighbour(id) for id in standing.above if id in neighbours],
+      below=[neighbour(id) for id in standing.below if id in neighbours],
+    )
+    return JsonResponse(data)
+
+
+def get_answer_contest_problem(problem, entry=None):
+  if entry is None:
+    entry = get_answer_entries([problem.id])[problem.id]
+  ans = list(entry.options)
   random.shuffle(ans)
-  answer = [(chr(idx + 65), answer.description) for idx, answer in enumerate(ans) ]
+  answer = [(chr(idx + 65), description) for idx, description in enumerate(ans) ]
   return answer
 
 def get_participation(user, contest):
@@ -460,22 +680,23 @@ class ContestTaskView(LoginRequiredMixin, ContestMixin, TitleMixin, DetailView):
 
   def get_context_data(self, **kwargs):
       context = super().get_context_data(**kwargs)
-      problems = list(ContestProblem.objects.filter(contest=self.object).order_by('order'))
+      problems = list(ContestProblem.objects.filter(contest=self.object).select_related('problem').order_by('order'))
       random.shuffle(problems)
       user = self.request.user
       contest = self.object
       auth = user.is_authenticated and user.current_contest is not None and user.current_contest.contest == contest
       auth = auth or self.is_editor
       context['problems'] = []
+      entries = get_answer_entries(problem.problem_id for problem in problems)
       for problem in problems:
-        answer = get_answer_contest_problem(problem.problem)
+        answer = get_answer_contest_problem(problem.problem, entries[problem.problem_id])
         context['problems'].append((problem, answer))
       participation = get_participation(user, contest)
       if Submission.objects.filter(user=participation, contest=contest).order_by('-date').exists():
         last_submission = Submission.objects.filter(user=participation, contest=contest).order_by('-date').first()
       else:
         last_submission = None
-      if last_submission is None or last_submission.result != 'PE':
+      if last_submission is None or last_submission.result != 'PE' or last_submission.time is not None:
         submission = Submission.objects.create(
           user=participation,
           contest=contest,
@@ -487,35 +708,24 @@ class ContestTaskView(LoginRequiredMixin, ContestMixin, TitleMixin, DetailView):
       return context
   
   def post(self, request, *args, **kwargs):
-    key = request.POST.get('contest', None)
     sub_id = request.POST.get('submission', None)
-    if key is None or sub_id is None:
+    if sub_id is None:
       raise Http404
+    # Only the user's own submissions can be answered, and only with the problems of their contest.
     try:
-      contest = Contest.objects.get(key=key)
-      submission = Submission.objects.get(id=sub_id)
-    except (Contest.DoesNotExist, Submission.DoesNotExist):
+      submission = Submission.objects.get(id=sub_id, user__user=request.user)
+    except (Submission.DoesNotExist, ValueError):
       raise Http404
 
-    if submission.problems.exists():
+    problems = ContestProblem.objects.filter(contest_id=submission.contest_id).only('id')
+    if not ingest_answers(submission, problems, request.POST):
       return generic_message(request, _('Duplicate submission'),
                             _('You must click "Take a test" button to start contest'))
 
-    problems = ContestProblem.objects.filter(contest=contest).select_related('problem').defer('problem__description')
-    for problem in problems:
-      ans = request.POST.get('answer_' + str(problem.id), None)
-      if ans is not None:
-        submissionProblem = SubmissionProblem.objects.get_or_create(
-          submission=submission,
-          problem=problem,
-        )[0]
-        submissionProblem.output = ans
-        submissionProblem.save()
     submission.time = timezone.now()
     # print(submission.id)
     submission.save()
-    submission.judge()
-    submission.update_contest()
+    enqueue_submission(submission)
 
     return HttpResponseRedirect(reverse('education:all_submissions'))
   
@@ -556,11 +766,12 @@ class ContestRawView(ContestMixin, DetailView):
 
   def get_context_data(self, **kwargs):
     context = super().get_context_data(**kwargs)
-    contestProblem = list(ContestProblem.objects.filter(contest=self.object).order_by('order'))
+    contestProblem = list(ContestProblem.objects.filter(contest=self.object).select_related('problem').order_by('order'))
     random.shuffle(contestProblem)
     problems = []
+    entries = get_answer_entries(problem.problem_id for problem in contestProblem)
     for problem in contestProblem:
-      answer = get_answer_contest_problem(problem.problem)
+      answer = get_answer_contest_problem(problem.problem, entries[problem.problem_id])
       problems.append((problem, answer))
     context['problems'] = problems
     context['math_engine'] = 'jax'
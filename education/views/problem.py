@@ -1,7 +1,7 @@
 import json
 
 from django.http import Http404, HttpResponseRedirect, JsonResponse
-from django.db.models import Q, Count
+from django.db.models import Count
 from django.urls import reverse
 from django.views.generic import DetailView, ListView, TemplateView
 from django.utils.translation import gettext_lazy as _
@@ -15,9 +15,12 @@ from education.models import Problem, ProblemGroup
 from backend.models import Profile
 from backend.utils.views import QueryStringSortMixin, TitleMixin, generic_message
 from backend.utils.strings import safe_int_or_none, safe_float_or_none
-from education.models.problem import Answer, Level
+from education.models.problem import Level
+from education.grading import get_answer_entries, ingest_answers
+from education.problem_list import get_level_listings, problem_list_key
+from education.visibility import listed_problems_q
 # from education.models.statistic import StatisticProblem
-from education.models.submission import Submission, SubmissionProblem
+from education.models.submission import Submission
 
 class ProblemMixin(object):
     context_object_name = 'problem'
@@ -61,38 +64,18 @@ class ProblemList(TitleMixin, ListView):
         return self.request.user
 
     def get_queryset(self):
-        filter = Q(is_public=True)
-        if self.request.user.is_authenticated:
-            filter |= Q(authors=self.profile)
-        
-        queryset = Problem.objects.filter(filter)
-        if not self.request.user.has_perm('education.see_organization_problem'):
-            filter = Q(is_organization_private=False)
-            if self.profile is not None:
-                filter |= Q(organizations__in=self.profile.organizations.all())
-            queryset = queryset.filter(filter)
-        
-        return queryset.distinct()
+        return Problem.objects.filter(listed_problems_q(self.request.user))
   
 
+    def get_levels(self):
+        return get_level_listings(self.get_queryset(), self.limit_show)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # context["category"] = self.category
-        levels = Level.objects.all()
-        queryset = self.get_queryset()
-        context['levels'] = []
-        for level in levels:
-            problems = queryset.filter(level=level)
-            if problems.count() > self.limit_show:
-                problems = problems[:self.limit_show - 1]
-                has_more = True
-            else:
-                has_more = False
-            context['levels'].append({
-                'level'   : level,
-                'problems': problems,
-                'has_more': has_more
-            })
+        # Only resolved by the template when the cached list is missing.
+        context['levels'] = self.get_levels
+        context['problem_list_key'] = problem_list_key(self.request.user)
         return context
 
 
@@ -136,20 +119,7 @@ class ProblemLevelList(QueryStringSortMixin, TitleMixin, ListView):
         return None
     
     def get_queryset(self):
-        queryset = Problem.objects.filter(level=self.object)
-        filter = Q(is_public=True)
-        if self.user is not None:
-            filter |= Q(authors=self.user)
-        
-        queryset = queryset.filter(filter)
-
-        if self.user is None or not self.user.has_perm('education:see_organization_problem'):
-            filter = Q(is_organization_private=False)
-            if self.user is not None:
-                filter |= Q(organizations__in=self.user.organizations.all())
-            queryset = queryset.filter(filter)
-        
-        return queryset.distinct()
+        return Problem.objects.filter(listed_problems_q(self.request.user), level=self.object)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -166,8 +136,8 @@ class ProblemLevelList(QueryStringSortMixin, TitleMixin, ListView):
 
 
 def get_answer(problem):
-    answers = Answer.objects.filter(problem=problem)
-    answer = [(chr(idx + 65), answer.description) for idx, answer in enumerate(answers) ]
+    entry = get_answer_entries([problem.id])[problem.id]
+    answer = [(chr(idx + 65), description) for idx, description in enumerate(entry.options) ]
     return answer
 
 
@@ -237,19 +207,13 @@ def problemSubmit(request, *args, **kwargs):
                 _("Restrict to submit problem"),
                 _('You need at least %ss to submit this problem.') % round((submission.time + timezone.timedelta(seconds=300) - timezone.now()).total_seconds()),
             )
-        ans = request.POST.get('answer_' + str(problem.id))
         submission = Submission.objects.create(
             profile=user,
             problem=problem, 
             is_contest=False,
             time=timezone.now()
         )
-        submissionProblem = SubmissionProblem.objects.get_or_create(
-            submission=submission,
-            task=problem
-        )[0]
-        submissionProblem.output = ans
-        submissionProblem.save()
+        ingest_answers(submission, [problem], request.POST, field='task')
         submission.judge()
         # sp = StatisticProblem.objects.get_or_create(user=user, date=timezone.now().date())[0]
         # sp.update_problem(submission)
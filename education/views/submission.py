@@ -133,7 +133,8 @@ class AllSubmissions(InfinitePaginationMixin, SubmissionsListBase):
         return True
 
     def get_queryset(self):
-        return super().get_queryset().exclude(result='PE')
+        # Submissions waiting in the grading queue already have a completion time and are shown as pending.
+        return super().get_queryset().exclude(result='PE', time__isnull=True)
 
     def get_context_data(self, **kwargs):
         context = super(AllSubmissions, self).get_context_data(**kwargs)
@@ -0,0 +1,181 @@
+"""
+Indexes of the restricted contests and problems every user can see, so that listing them is a filter on the
+public flags and a small set of ids instead of a join over every access relation.
+
+A user sees a restricted contest through a grant: every organization grants its members the organization-private
+contests it is in, and every user is granted the contests they author, curate, may view the scoreboard of or
+were invited to. Grants are cached under a stamp bumped whenever a contest or one of its access relations
+changes, and those of a user also under the user's access stamp, which changes with their organizations.
+
+Problems work the same way, with organizations granting their members the public organization-private problems
+they are in, and users granted the problems they author. Problem grants are kept as sorted arrays of ids.
+"""
+import hashlib
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from backend.utils.versions import bump_versions, get_versions
+from education.access import user_access_version_key
+from education.models.contest import Contest
+from education.models.problem import Problem
+
+__all__ = ['public_contests_q', 'get_contest_grants', 'invalidate_contest_visibility', 'ProblemGrants',
+           'public_problems_q', 'get_problem_grants', 'listed_problems_q', 'listing_class', 'has_id',
+           'invalidate_problem_visibility']
+
+VISIBILITY_CACHE_TIMEOUT = 86400
+CONTEST_VERSION_KEY = 'contest_visibility_version'
+PROBLEM_VERSION_KEY = 'problem_visibility_version'
+
+# authored: the ids of the problems the user authors.
+# listed: the ids of the restricted problems listed to the user: those of their organizations, and those they
+# author unless private to organizations they are not in.
+ProblemGrants = namedtuple('ProblemGrants', 'authored listed')
+
+
+def public_contests_q():
+    return Q(is_visible=True, is_private=False, is_organization_private=False)
+
+
+def _restricted_contests():
+    return Contest.objects.filter(is_visible=True).filter(Q(is_private=True) | Q(is_organization_private=True))
+
+
+def _load_user_grants(user):
+    organization_ids = tuple(user.organizations.values_list('id', flat=True))
+    ids = set(Contest.authors.through.objects.filter(profile=user).values_list('contest_id', flat=True))
+    ids.update(Contest.curators.through.objects.filter(profile=user).values_list('contest_id', flat=True))
+    ids.update(_restricted_contests().filter(
+        Q(view_contest_scoreboard=user) |
+        Q(is_organization_private=False, private_contestants=user) |
+        Q(is_organization_private=True, is_private=True, organizations__in=organization_ids,
+          private_contestants=user)
+    ).values_list('id', flat=True))
+    return organization_ids, frozenset(ids)
+
+
+def _load_organization_grants(organization_id):
+    return frozenset(_restricted_contests().filter(is_organization_private=True, is_private=False,
+                                                   organizations=organization_id).values_list('id', flat=True))
+
+
+def get_contest_grants(user):
+    """
+    Returns the frozenset of ids of the restricted contests an authenticated user can see.
+    """
+    user_version_key = user_access_version_key(user.id)
+    versions = get_versions([CONTEST_VERSION_KEY, user_version_key])
+    version = versions[CONTEST_VERSION_KEY]
+
+    key = 'contest_grants:user:%d:%s:%s' % (user.id, version, versions[user_version_key])
+    grants = cache.get(key)
+    if grants is None:
+        grants = _load_user_grants(user)
+        cache.set(key, grants, VISIBILITY_CACHE_TIMEOUT)
+    organization_ids, ids = grants
+    if not organization_ids:
+        return ids
+
+    keys = {'contest_grants:organization:%d:%s' % (organization_id, version): organization_id
+            for organization_id in organization_ids}
+    cached = cache.get_many(keys.keys())
+    for key, organization_id in keys.items():
+        if key not in cached:
+            cached[key] = _load_organization_grants(organization_id)
+            cache.set(key, cached[key], VISIBILITY_CACHE_TIMEOUT)
+    return ids.union(*cached.values())
+
+
+def invalidate_contest_visibility():
+    bump_versions([CONTEST_VERSION_KEY])
+
+
+def public_problems_q():
+    return Q(is_public=True, is_organization_private=False)
+
+
+def _sorted_ids(ids):
+    return array('q', sorted(set(ids)))
+
+
+def has_id(ids, id):
+    """
+    Returns whether a sorted array of ids contains an id.
+    """
+    index = bisect_left(ids, id)
+    return index < len(ids) and ids[index] == id
+
+
+def _load_user_problem_grants(user):
+    organization_ids = tuple(user.organizations.values_list('id', flat=True))
+    authored = Problem.objects.filter(authors=user)
+    outside = authored.filter(is_organization_private=True).exclude(organizations__in=organization_ids)
+    return (organization_ids, _sorted_ids(authored.values_list('id', flat=True)),
+            _sorted_ids(outside.values_list('id', flat=True)))
+
+
+def _load_organization_problem_grants(organization_id):
+    return _sorted_ids(Problem.objects.filter(is_public=True, is_organization_private=True,
+                                              organizations=organization_id).values_list('id', flat=True))
+
+
+def get_problem_grants(user):
+    """
+    Returns the ProblemGrants of an authenticated user.
+    """
+    user_version_key = user_access_version_key(user.id)
+    versions = get_versions([PROBLEM_VERSION_KEY, user_version_key])
+    version = versions[PROBLEM_VERSION_KEY]
+
+    key = 'problem_grants:user:%d:%s:%s' % (user.id, version, versions[user_version_key])
+    grants = cache.get(key)
+    if grants is None:
+        grants = _load_user_problem_grants(user)
+        cache.set(key, grants, VISIBILITY_CACHE_TIMEOUT)
+    organization_ids, authored, outside = grants
+
+    keys = {'problem_grants:organization:%d:%s' % (organization_id, version): organization_id
+            for organization_id in organization_ids}
+    cached = cache.get_many(keys.keys()) if keys else {}
+    for key, organization_id in keys.items():
+        if key not in cached:
+            cached[key] = _load_organization_problem_grants(organization_id)
+            cache.set(key, cached[key], VISIBILITY_CACHE_TIMEOUT)
+    listed = set(authored).difference(outside).union(*cached.values())
+    return ProblemGrants(authored, _sorted_ids(listed))
+
+
+def _listing(user):
+    if not user.is_authenticated:
+        return 'public', public_problems_q(), ()
+    grants = get_problem_grants(user)
+    if user.has_perm('education.see_organization_problem'):
+        return 'all', Q(is_public=True), grants.authored
+    return 'public', public_problems_q(), grants.listed
+
+
+def listed_problems_q(user):
+    """
+    Returns the filter of the problems listed to a user: the public ones, the public ones of their organizations
+    and the ones they author. Users who may see every organization's problems are listed every public problem.
+    """
+    name, q, ids = _listing(user)
+    if ids:
+        q |= Q(id__in=ids)
+    return q
+
+
+def listing_class(user):
+    """
+    Returns a key shared by the users who are listed the same problems.
+    """
+    name, q, ids = _listing(user)
+    return '%s:%s' % (name, hashlib.sha1(ids.tobytes()).hexdigest()) if ids else name
+
+
+def invalidate_problem_visibility():
+    bump_versions([PROBLEM_VERSION_KEY])
@@ -0,0 +1,171 @@
+"""
+Publishes messages to the websocket event daemon.
+
+Every process keeps one persistent connection to the daemon's post endpoint, owned by a background thread.
+Publishing only puts the message on a bounded in-memory queue; the thread sends whatever has accumulated in
+one pipelined batch and reconnects with exponential backoff when the daemon can not be reached. Messages are
+dropped rather than blocking the caller when the queue is full. The id of the daemon's last message is
+remembered from its responses, so that pages can read it without waiting for the daemon.
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+from django.conf import settings
+from websocket import WebSocketException, create_connection
+
+__all__ = ['EventPostingError', 'EventPoster', 'post', 'last']
+
+logger = logging.getLogger('emath.event')
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 200
+BATCH_TRIES = 3
+CONNECT_TIMEOUT = 5
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30
+LAST_MSG_REFRESH = 5
+
+
+class EventPostingError(RuntimeError):
+    pass
+
+
+# Asks the daemon for the id of its last message, so that last() stays fresh while nothing is posted.
+_LAST_MSG = {'command': 'last-msg'}
+
+
+class EventPoster(object):
+    def __init__(self, url):
+        self.url = url
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._conn = None
+        self._backoff = 0
+        # The id of the last message the daemon reported, when, and whether the thread was asked to refresh it.
+        self._last_id = 0
+        self._refreshed = None
+        self._refreshing = False
+
+    def _get_queue(self):
+        # Threads do not survive a fork, so a forked worker starts its own flush thread.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(QUEUE_SIZE)
+                    self._conn = None
+                    self._refreshing = False
+                    thread = threading.Thread(target=self._run, args=(self._queue,), name='event-poster',
+                                              daemon=True)
+                    thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def post(self, channel, message):
+        try:
+            self._get_queue().put_nowait({'command': 'post', 'channel': channel, 'message': message})
+        except queue.Full:
+            logger.warning('Event queue is full, dropping message to %s', channel)
+            return False
+        return True
+
+    def last(self):
+        """
+        Returns the id of the last message the daemon reported, without waiting for it. Asks the flush thread to
+        refresh it if it is older than LAST_MSG_REFRESH seconds.
+        """
+        pending = self._get_queue()
+        if not self._refreshing and (self._refreshed is None or
+                                     time.monotonic() - self._refreshed > LAST_MSG_REFRESH):
+            self._refreshing = True
+            try:
+                pending.put_nowait(_LAST_MSG)
+            except queue.Full:
+                self._refreshing = False
+        return self._last_id
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception:
+                logger.exception('Failed to post %d events', len(batch))
+            finally:
+                if _LAST_MSG in batch:
+                    self._refreshing = False
+
+    def _flush(self, batch):
+        for tries in range(BATCH_TRIES):
+            if self._backoff:
+                time.sleep(self._backoff)
+            try:
+                if self._conn is None:
+                    self._conn = create_connection(self.url, timeout=CONNECT_TIMEOUT)
+                # The daemon answers the commands of a connection in order, so the whole batch is sent
+                # before reading any response.
+                for request in batch:
+                    self._conn.send(json.dumps(request))
+                for request in batch:
+                    response = json.loads(self._conn.recv())
+                    if response['status'] == 'error':
+                        raise EventPostingError(response['code'])
+                    # Posts and last-msg are both answered with the id of the daemon's last message, in order.
+                    self._last_id = response.get('id', self._last_id)
+                self._refreshed = time.monotonic()
+            except (WebSocketException, socket.error, ValueError, KeyError, EventPostingError) as e:
+                logger.warning('Failed to post events (attempt %d): %r', tries + 1, e)
+                self._close()
+                self._backoff = min(max(self._backoff * 2, BACKOFF_MIN), BACKOFF_MAX)
+            else:
+                self._backoff = 0
+                return
+        logger.error('Dropping %d events after %d attempts', len(batch), BATCH_TRIES)
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+
+_poster = None
+
+
+def _get_poster():
+    global _poster
+    if _poster is None:
+        _poster = EventPoster(settings.EVENT_DAEMON_POST)
+    return _poster
+
+
+def post(channel, message):
+    """
+    Queues a JSON-serializable message for a channel of the event daemon. Returns False if events are
+    disabled or the message was dropped.
+    """
+    if not settings.EVENT_DAEMON_USE:
+        return False
+    return _get_poster().post(channel, message)
+
+
+def last():
+    """
+    Returns the id of the last message posted to the event daemon, as last reported by it, or 0 if it is
+    unknown. Never waits for the daemon.
+    """
+    if not settings.EVENT_DAEMON_USE:
+        return 0
+    return _get_poster().last()
@@ -118,6 +118,9 @@ MIDDLEWARE = [
     'backend.middleware.TimezoneMiddleware',
 ]
 
+# ModelBackend stays for the sessions that were logged in through it, until they log in again.
+AUTHENTICATION_BACKENDS = ['backend.auth.ProfileBackend', 'django.contrib.auth.backends.ModelBackend']
+
 ROOT_URLCONF = 'emath.urls'
 
 TEMPLATES = [
@@ -211,6 +214,45 @@ EVENT_DAEMON_KEY = None
 EVENT_DAEMON_AMQP_EXCHANGE = 'dmoj-events'
 EVENT_DAEMON_SUBMISSION_KEY = '6Sdmkx^%pk@GsifDfXcwX*Y7LRF%RGT8vmFpSxFBT$fwS7trc8raWfN#CSfQuKApx&$B#Gh2L7p%W!Ww'
 
+# Celery configuration
+CELERY_BROKER_URL = 'redis://127.0.0.1:6379/3'
+CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/3'
+CELERY_TASK_IGNORE_RESULT = True
+
+# Grade contest submissions in the celery worker instead of the web request.
+EMATH_JUDGE_ASYNC = True
+
+# Keep a materialized scoreboard of every contest in the redis server behind the default cache.
+EMATH_REDIS_SCOREBOARD = True
+
+# Seconds between the scoreboard snapshots of running contests, see CELERY_BEAT_SCHEDULE.
+EMATH_SCOREBOARD_SNAPSHOT_INTERVAL = 300
+
+# Directory the scoreboards of running public contests are written to as static JSON files, served by nginx
+# at EMATH_SCOREBOARD_JSON_URL. Leave empty to serve every ranking page from Django.
+EMATH_SCOREBOARD_JSON_ROOT = ''
+EMATH_SCOREBOARD_JSON_URL = '/scoreboard/'
+EMATH_SCOREBOARD_JSON_GZIP = True
+# Seconds between two writes of the scoreboard of a contest, see CELERY_BEAT_SCHEDULE.
+EMATH_SCOREBOARD_JSON_INTERVAL = 10
+
+CELERY_BEAT_SCHEDULE = {
+    'snapshot-scoreboards': {
+        'task': 'education.tasks.snapshot_scoreboards',
+        'schedule': EMATH_SCOREBOARD_SNAPSHOT_INTERVAL,
+    },
+    'finalize-contests': {
+        'task': 'education.tasks.finalize_contests',
+        'schedule': 600,
+    },
+    'publish-scoreboards': {
+        'task': 'education.tasks.publish_scoreboards',
+        'schedule': EMATH_SCOREBOARD_JSON_INTERVAL,
+        # Runs that could not start within an interval are superseded by the next one.
+        'options': {'expires': EMATH_SCOREBOARD_JSON_INTERVAL},
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
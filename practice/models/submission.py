@@ -1,10 +1,13 @@
+from operator import attrgetter
+
 from django.db import models
+from django.db.models import Sum
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
 from django.utils.functional import cached_property
 
-from education.models.problem import Answer
+from education.grading import grade_problems, contest_problem_id, contest_problem_points
 
 SUBMISSION_RESULT = (
     ('AC', _('Accepted')),
@@ -72,15 +75,12 @@ class Submission(models.Model):
     def get_absolute_url(self):
         return reverse("submission_status", kwargs={"pk": self.pk})
 
-    def judge(self):
-        self.points = 0.0
-        self.max_points = 0.0
-        for problem in self.contest.problems.all():
-            self.max_points += problem.points
-        for problem in self.problems.all():
-            problem.calculator()
-            self.points += problem.points
+    def judge(self, answers=None):
+        self.max_points = float(self.contest.problems.aggregate(points=Sum('points'))['points'] or 0)
+        problems = list(self.problems.select_related('problem'))
+        self.points = grade_problems(problems, contest_problem_id, contest_problem_points, answers)
         self.result = 'AC' if self.points == self.max_points else 'WA'
+        SubmissionProblem.objects.bulk_update(problems, ['result', 'points'])
         self.save(update_fields=['points', 'max_points', 'result'])
     judge.alters_data = True
 
@@ -102,29 +102,13 @@ class SubmissionProblem(models.Model):
     points = models.FloatField(_("points granted"), null=True)
     output = models.TextField(_("student's answer"), blank=True)
 
-    def calculator(self):
-        if self.problem.problem.answer_type == 'mc':
-            answer = Answer.objects.get(problem=self.problem.problem, is_correct=True)
-        if self.problem.problem.answer_type == 'fill':
-            answer = Answer.objects.filter(problem=self.problem.problem).first()
-        self.result = answer.description == self.output
-        if self.result:
-            self.points = self.problem.points
-        else:
-            self.points = 0
+    def calculator(self, answers=None):
+        grade_problems([self], contest_problem_id, contest_problem_points, answers)
         self.save(update_fields=['result', 'points'])
     calculator.alters_data = True
     
-    def calculatorTask(self):
-        if self.task.answer_type == 'mc':
-            answer = Answer.objects.get(problem=self.task, is_correct=True)
-        if self.task.answer_type == 'fill':
-            answer = Answer.objects.filter(problem=self.task).first()
-        self.result = answer.description == self.output
-        if self.result:
-            self.points = 100
-        else:
-            self.points = 0
+    def calculatorTask(self, answers=None):
+        grade_problems([self], attrgetter('task_id'), lambda problem: 100, answers)
         self.save(update_fields=['result', 'points'])
     calculatorTask.alters_data = True
 
@@ -1,3 +1,62 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.http import Http404
+from django.test import RequestFactory, TestCase
 
-# Create your tests here.
+from backend.models import Profile
+from education.models import Answer, Level, Problem
+from practice.models import Practice, PracticeProblem, Submission
+from practice.views import PracticeTaskView
+
+
+class PracticeTaskPostTestCase(TestCase):
+    def setUp(self):
+        level = Level.objects.create(code='l', name='L', description='L')
+        self.practice, other = (Practice.objects.create(name='Practice', level=level) for _ in range(2))
+        self.problem, self.other_problem = (
+            PracticeProblem.objects.create(contest=practice, problem=Problem.objects.create(
+                code=code, name=code, description=code, level=level, answer_type='fill'))
+            for practice, code in ((self.practice, 'p1'), (other, 'p2')))
+        self.owner = Profile.objects.create_user('owner', 'owner', 'x')
+        self.submission = Submission.objects.create(profile=self.owner, contest=self.practice, result='PE')
+
+    def post(self, user, data):
+        request = RequestFactory().post('/', dict(data, submission=self.submission.id))
+        request.user = user
+        return PracticeTaskView.as_view()(request, pk=self.practice.id)
+
+    def answers(self):
+        return dict(self.submission.problems.values_list('problem_id', 'output'))
+
+    def test_answers_own_submission(self):
+        response = self.post(self.owner, {'answer_%d' % self.problem.id: '42',
+                                          'answer_%d' % self.other_problem.id: '7'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.answers(), {self.problem.id: '42'})
+
+    def test_rejects_other_users(self):
+        with self.assertRaises(Http404):
+            self.post(Profile.objects.create_user('intruder', 'intruder', 'x'), {'answer_%d' % self.problem.id: '42'})
+        self.assertEqual(self.answers(), {})
+
+
+class PracticeGradingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        level = Level.objects.create(code='l', name='L', description='L')
+        self.practice = Practice.objects.create(name='Practice', level=level)
+        self.problems = []
+        for code, correct, points in (('p1', '42', 2), ('p2', '7', 3)):
+            problem = Problem.objects.create(code=code, name=code, description=code, level=level, answer_type='fill')
+            Answer.objects.create(problem=problem, description=correct)
+            self.problems.append(PracticeProblem.objects.create(contest=self.practice, problem=problem, points=points))
+        self.submission = Submission.objects.create(profile=Profile.objects.create_user('user', 'user', 'x'),
+                                                    contest=self.practice, result='PE')
+
+    def test_judge(self):
+        for problem, output in zip(self.problems, (' 42 ', '8')):
+            self.submission.problems.create(problem=problem, output=output)
+        self.submission.judge()
+        self.submission.refresh_from_db()
+        self.assertEqual((self.submission.points, self.submission.max_points, self.submission.result), (2, 5, 'WA'))
+        self.assertEqual(list(self.submission.problems.order_by('id').values_list('result', 'points')),
+                         [(True, 2), (False, 0)])
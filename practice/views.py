@@ -13,10 +13,10 @@ from backend.utils.infinite_paginator import InfinitePaginationMixin
 from backend.utils.problems import _get_result_data
 from backend.utils.raw_sql import join_sql_subquery, use_straight_join
 
+from education.grading import get_answer_entries, ingest_answers
 from education.models.problem import Level, Problem
 from education.views.contest import get_answer_contest_problem
 from practice.models.practice import PracticeProblem
-from practice.models.submission import SubmissionProblem
 from .forms import PracticeForm
 from .models import Practice, Submission
 from backend.utils.views import DiggPaginatorMixin, TitleMixin, generic_message
@@ -73,12 +73,13 @@ class PracticeTaskView(LoginRequiredMixin, TitleMixin, DetailView):
 
   def get_context_data(self, **kwargs):
       context = super().get_context_data(**kwargs)
-      problems = list(PracticeProblem.objects.filter(contest=self.object))
+      problems = list(PracticeProblem.objects.filter(contest=self.object).select_related('problem'))
       user = self.request.user
       practice = self.object
       context['problems'] = []
+      entries = get_answer_entries(problem.problem_id for problem in problems)
       for problem in problems:
-        answer = get_answer_contest_problem(problem.problem)
+        answer = get_answer_contest_problem(problem.problem, entries[problem.problem_id])
         context['problems'].append((problem, answer))
       if Submission.objects.filter(profile=user, contest=practice).order_by('-date').exists():
         last_submission = Submission.objects.filter(profile=user, contest=practice).order_by('-date').first()
@@ -96,30 +97,20 @@ class PracticeTaskView(LoginRequiredMixin, TitleMixin, DetailView):
       return context
   
   def post(self, request, *args, **kwargs):
-    id = request.POST.get('contest', None)
     sub_id = request.POST.get('submission', None)
-    if id is None or sub_id is None:
+    if sub_id is None:
       raise Http404
+    # Only the user's own submissions can be answered, and only with the problems of their practice.
     try:
-      practice = Practice.objects.get(id=id)
-      submission = Submission.objects.get(id=sub_id)
-    except (Practice.DoesNotExist, Submission.DoesNotExist):
+      submission = Submission.objects.get(id=sub_id, profile=request.user)
+    except (Submission.DoesNotExist, ValueError):
       raise Http404
 
-    if submission.problems.exists():
+    problems = PracticeProblem.objects.filter(contest_id=submission.contest_id).only('id')
+    if not ingest_answers(submission, problems, request.POST):
       return generic_message(request, _('Duplicate submission'),
                             _('You must click "Practice" button to start practice'))
 
-    problems = PracticeProblem.objects.filter(contest=practice).select_related('problem').defer('problem__description')
-    for problem in problems:
-      ans = request.POST.get('answer_' + str(problem.id), None)
-      if ans is not None:
-        submissionProblem = SubmissionProblem.objects.get_or_create(
-          submission=submission,
-          problem=problem,
-        )[0]
-        submissionProblem.output = ans
-        submissionProblem.save()
     submission.time = timezone.now()
     # print(submission.id)
     submission.save()
@@ -0,0 +1,70 @@
+// Receives the messages posted to some channels of the event daemon, through its websocket endpoint or,
+// when websockets are unavailable, by long polling its http endpoint.
+function EventReceiver(websocket, poller, channels, last_msg, onmessage) {
+  this.websocket_path = websocket;
+  this.channels = channels;
+  this.last_msg = last_msg;
+  this.poller_path = poller + channels.join('|');
+  if (onmessage)
+    this.onmessage = onmessage;
+  var receiver = this;
+  var time_retry = 1000;
+
+  function got_message(data) {
+    if (data.status === 'error')
+      return;
+    receiver.last_msg = data.id;
+    receiver.onmessage(data.message);
+  }
+
+  function init_poll() {
+    function long_poll() {
+      $.ajax({
+        url: receiver.poller_path,
+        data: {last: receiver.last_msg},
+        success: function (data) {
+          time_retry = 1000;
+          got_message(data);
+          long_poll();
+        },
+        error: function (jqXHR) {
+          if (jqXHR.status === 504)
+            long_poll();
+          else {
+            setTimeout(long_poll, time_retry);
+            time_retry = Math.min(time_retry * 2, 60000);
+          }
+        },
+        dataType: 'json'
+      });
+    }
+
+    long_poll();
+  }
+
+  if (window.WebSocket) {
+    this.websocket = new WebSocket(websocket);
+    var timeout = setTimeout(function () {
+      receiver.websocket.close();
+      receiver.websocket = null;
+      init_poll();
+    }, 2000);
+    this.websocket.onopen = function () {
+      clearTimeout(timeout);
+      this.send(JSON.stringify({command: 'start-msg', start: receiver.last_msg}));
+      this.send(JSON.stringify({command: 'set-filter', filter: receiver.channels}));
+    };
+    this.websocket.onmessage = function (event) {
+      got_message(JSON.parse(event.data));
+    };
+    this.websocket.onclose = function (event) {
+      if (event.code !== 1000 && receiver.websocket !== null) {
+        receiver.websocket = null;
+        init_poll();
+      }
+    };
+  } else {
+    this.websocket = null;
+    init_poll();
+  }
+}
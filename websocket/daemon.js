@@ -1,14 +1,10 @@
 var config = require('./config');
-var set = require('simplesets').Set;
-var queue = require('qu');
 var WebSocketServer = require('ws').Server;
 var wss_receiver = new WebSocketServer({host: config.get_host, port: config.get_port});
 var wss_sender = new WebSocketServer({host: config.post_host, port: config.post_port});
-var messages = new queue();
-var followers = new set();
-var pollers = new set();
 var max_queue = config.max_queue || 50;
 var long_poll_timeout = config.long_poll_timeout || 60000;
+var channel_ttl = config.channel_ttl || 600000;
 var message_id = Date.now();
 
 if (typeof String.prototype.startsWith != 'function') {
@@ -17,37 +13,105 @@ if (typeof String.prototype.startsWith != 'function') {
     };
 }
 
-messages.catch_up = function (client) {
-    this.each(function (message) {
-        if (message.id > client.last_msg)
-            client.got_message(message);
-    });
+// Keeps the last `size` messages posted to a channel, oldest first.
+function RingBuffer(size) {
+    this.size = size;
+    this.items = [];
+    this.start = 0;
+}
+
+RingBuffer.prototype.push = function (item) {
+    if (this.items.length < this.size)
+        this.items.push(item);
+    else {
+        this.items[this.start] = item;
+        this.start = (this.start + 1) % this.size;
+    }
 };
 
-messages.post = function (channel, message) {
+RingBuffer.prototype.since = function (id) {
+    var result = [];
+    for (var i = 0; i < this.items.length; ++i) {
+        var item = this.items[(this.start + i) % this.items.length];
+        if (item.id > id)
+            result.push(item);
+    }
+    return result;
+};
+
+// channel name -> {followers, pollers, messages, last_post}
+var channels = new Map();
+
+function get_channel(name) {
+    var channel = channels.get(name);
+    if (channel === undefined) {
+        channel = {
+            followers: new Set(),
+            pollers: new Set(),
+            messages: new RingBuffer(max_queue),
+            last_post: Date.now()
+        };
+        channels.set(name, channel);
+    }
+    return channel;
+}
+
+function subscribe(client, names, kind) {
+    names.forEach(function (name) {
+        get_channel(name)[kind].add(client);
+    });
+}
+
+function unsubscribe(client, names, kind) {
+    names.forEach(function (name) {
+        var channel = channels.get(name);
+        if (channel !== undefined)
+            channel[kind].delete(client);
+    });
+}
+
+// The messages of some channels newer than last_msg, in posting order.
+function catch_up(names, last_msg) {
+    var result = [];
+    names.forEach(function (name) {
+        var channel = channels.get(name);
+        if (channel !== undefined)
+            result = result.concat(channel.messages.since(last_msg));
+    });
+    return result.sort(function (a, b) {
+        return a.id - b.id;
+    });
+}
+
+function post(name, message) {
     message = {
         id: ++message_id,
-        channel: channel,
+        channel: name,
         message: message
     };
-    this.push(message);
-    if (this.length > max_queue)
-        this.shift();
-    followers.each(function (client) {
+    var channel = get_channel(name);
+    channel.messages.push(message);
+    channel.last_post = Date.now();
+    channel.followers.forEach(function (client) {
         client.got_message(message);
     });
-    pollers.each(function (request) {
+    channel.pollers.forEach(function (request) {
         request.got_message(message);
     });
     return message.id;
-};
+}
 
-messages.last = function () {
-    return this.tail().id;
-};
+// Forget the messages of channels nobody listened to for a while.
+setInterval(function () {
+    var expired = Date.now() - channel_ttl;
+    channels.forEach(function (channel, name) {
+        if (!channel.followers.size && !channel.pollers.size && channel.last_post < expired)
+            channels.delete(name);
+    });
+}, Math.min(channel_ttl, 60000));
 
 wss_receiver.on('connection', function (socket) {
-    socket.channel = null;
+    socket.channels = [];
     socket.last_msg = 0;
 
     var commands = {
@@ -63,9 +127,10 @@ wss_receiver.on('connection', function (socket) {
                     filter[channel] = true;
                     return true;
             })) {
-                socket.filter = filter;
-                followers.add(socket);
-                messages.catch_up(socket);
+                unsubscribe(socket, socket.channels, 'followers');
+                socket.channels = Object.keys(filter);
+                subscribe(socket, socket.channels, 'followers');
+                catch_up(socket.channels, socket.last_msg).forEach(socket.got_message);
             } else {
                 socket.send(JSON.stringify({
                     status: 'error',
@@ -77,8 +142,7 @@ wss_receiver.on('connection', function (socket) {
     };
 
     socket.got_message = function (message) {
-        if (message.channel in socket.filter)
-            socket.send(JSON.stringify(message));
+        socket.send(JSON.stringify(message));
         socket.last_msg = message.id;
     };
 
@@ -105,7 +169,7 @@ wss_receiver.on('connection', function (socket) {
     });
 
     socket.on('close', function(code, message) {
-        followers.remove(socket);
+        unsubscribe(socket, socket.channels, 'followers');
     });
 });
 
@@ -119,7 +183,7 @@ wss_sender.on('connection', function (socket) {
                 };
             return {
                 status: 'success',
-                id: messages.post(request.channel, request.message)
+                id: post(request.channel, request.message)
             };
         },
         last_msg: function (request) {
@@ -162,43 +226,33 @@ require('http').createServer(function (req, res) {
         return;
     }
 
-    var channels = parts.pathname.slice(10).split('|');
-    if (channels.length == 1 && !channels[0].length) {
+    var names = parts.pathname.slice(10).split('|');
+    if (names.length == 1 && !names[0].length) {
         res.writeHead(400, {'Content-Type': 'text/plain'});
         res.end('400 Bad Request');
         return;
     }
 
-    req.channels = {};
     req.last_msg = parseInt(parts.query.last);
     if (isNaN(req.last_msg)) req.last_msg = 0;
 
-    channels.forEach(function (channel) {
-        req.channels[channel] = true;
-    });
-
     req.on('close', function () {
-        pollers.remove(req);
+        unsubscribe(req, names, 'pollers');
     });
 
     req.got_message = function (message) {
-        if (message.channel in req.channels) {
-            res.writeHead(200, {'Content-Type': 'application/json'});
-            res.end(JSON.stringify(message));
-            pollers.remove(req);
-            return true;
-        }
-        return false;
+        res.writeHead(200, {'Content-Type': 'application/json'});
+        res.end(JSON.stringify(message));
+        unsubscribe(req, names, 'pollers');
     };
-    var got = false;
-    messages.each(function (message) {
-        if (!got && message.id > req.last_msg)
-            got = req.got_message(message);
-    });
-    if (!got) {
-        pollers.add(req);
+
+    var missed = catch_up(names, req.last_msg);
+    if (missed.length)
+        req.got_message(missed[0]);
+    else {
+        subscribe(req, names, 'pollers');
         res.setTimeout(long_poll_timeout, function () {
-            pollers.remove(req);
+            unsubscribe(req, names, 'pollers');
             res.writeHead(504, {'Content-Type': 'application/json'});
             res.end('{"error": "timeout"}');
         });